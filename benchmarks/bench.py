@@ -0,0 +1,377 @@
+"""
+Benchmarks of the event loop and its hot operations.
+
+Simulator.run is timed under every registered scheduler at low, medium and
+near saturation loads, reporting events per second and nanoseconds per
+event, alongside microbenchmarks of the operations the loop spends its
+time in.  Results are written as JSON so runs can be compared across
+commits:
+
+    python -m benchmarks.bench --output before.json
+    python -m benchmarks.bench --output after.json --compare before.json
+
+With --compare a report of every benchmark's change is printed and the
+exit status is non-zero if any got slower than the threshold allows.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import count
+from pathlib import Path
+
+import numpy as np
+from arrow import Arrow
+
+from src.commons.commons import exp_scale, rand_exp_float
+from src.modeller import Modeller
+from src.policies import POLICIES
+from src.process import Process
+from src.queues import EventQueue, FifoProcessQueue, MultilevelQueue, PriorityProcessQueue, \
+    ResponseRatioQueue
+from src.event import Event
+from src.sim import Simulator
+from src.stats import OnlineStats
+from src.workload import Workload
+
+ROOT = Path(__file__).resolve().parent.parent
+# Offered loads rho = rate * mean burst of the simulation benchmarks
+LOADS = {'low': 0.3, 'medium': 0.7, 'saturated': 0.95}
+BURST = 0.06
+QUANTUM = 0.05
+SEED = 1234
+# Processes already queued while a queue operation is timed
+QUEUE_DEPTH = 1000
+# Queue length of an overloaded system, for queues whose operations grow with it
+OVERLOAD_DEPTH = 10000
+
+
+def measure(func, number: int, repeat: int) -> dict:
+    """
+    Time a function with the garbage collector off
+    :param func: callable doing `number` operations per call
+    :param number: operations per call
+    :param repeat: number of calls, the fastest is reported
+    :return: dict of ns_per_op of the fastest call, median_ns_per_op and ops_per_sec
+    """
+    times = []
+    # Like timeit, keep collector pauses out of the measurements
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        if enabled:
+            gc.enable()
+    best = min(times)
+    return {'ns_per_op': best * 1e9,
+            'median_ns_per_op': statistics.median(times) * 1e9,
+            'ops_per_sec': 1 / best}
+
+
+def bench_simulation(policy, rho: float, length: int, repeat: int) -> dict:
+    """
+    Time Simulator.run, output files are written to the current directory
+    :param policy: registered Policy subclass
+    :param rho: offered load
+    :param length: processes per simulation
+    :param repeat: number of runs, the fastest is reported
+    :return: dict of ns_per_op and ops_per_sec per event, plus the event count
+    """
+    created_at = Arrow.utcfromtimestamp(0)
+    Modeller.get_data_path(created_at.timestamp).mkdir(parents=True, exist_ok=True)
+    rate = rho / exp_scale(BURST)
+    events = []
+
+    def run():
+        sim = Simulator(created_at=created_at,
+                        length=length,
+                        burst_lambda=BURST,
+                        process_rate=rate,
+                        method=policy.type,
+                        quantum=QUANTUM if policy.takes_quantum else None,
+                        seed=SEED,
+                        raw_format=None)
+        sim.run()
+        events.append(sim.events)
+
+    # Same seed every run, so every run processes the same events
+    run()
+    result = measure(run, events[0], repeat)
+    result['events'] = events[0]
+    return result
+
+
+def bench_event_queue(number: int) -> callable:
+    """Push then pop one event on a queue holding QUEUE_DEPTH events"""
+    queue = EventQueue()
+    times = np.random.default_rng(SEED).random(QUEUE_DEPTH + number)
+    queue.put_many(Event(created_at=float(at), event_type=1) for at in times[:QUEUE_DEPTH])
+    events = [Event(created_at=float(at), event_type=1) for at in times[QUEUE_DEPTH:]]
+
+    def run():
+        put, get = queue.put, queue.get
+        for event in events:
+            put(event)
+            get()
+    return run
+
+
+def bench_process_queue(queue, number: int) -> callable:
+    """Put then get one process on a ready queue holding QUEUE_DEPTH processes"""
+    keys = np.random.default_rng(SEED).random(QUEUE_DEPTH + number).tolist()
+    processes = [Process(run_time=key, process_id=i, created_at=float(i))
+                 for i, key in enumerate(keys)]
+    for process, key in zip(processes[:QUEUE_DEPTH], keys):
+        queue.put(process, key)
+    pending = list(zip(processes[QUEUE_DEPTH:], keys[QUEUE_DEPTH:]))
+
+    def run():
+        put, get = queue.put, queue.get
+        for process, key in pending:
+            put(process, key)
+            get()
+    return run
+
+
+def bench_response_ratio_queue(number: int, depth: int = QUEUE_DEPTH) -> callable:
+    """Put then get one process on a response ratio queue holding depth processes"""
+    queue = ResponseRatioQueue()
+    rng = np.random.default_rng(SEED)
+    services = rng.exponential(BURST, depth + number).tolist()
+    processes = [Process(run_time=service, process_id=i, created_at=i * BURST)
+                 for i, service in enumerate(services)]
+    for process in processes[:depth]:
+        queue.put(process, process.run_time)
+    pending = processes[depth:]
+    # Time keeps moving forward across repeats, one arrival per mean burst
+    ticks = count(depth)
+
+    def run():
+        put, get = queue.put, queue.get
+        for process in pending:
+            now = next(ticks) * BURST
+            put(process, process.run_time, now)
+            get(now)
+    return run
+
+
+def bench_process_lt(number: int) -> callable:
+    """Compare pairs of processes"""
+    rng = np.random.default_rng(SEED)
+    # Equal arrival times make every comparison look at the remaining time too
+    processes = [Process(run_time=run_time, process_id=i, created_at=float(i % 2))
+                 for i, run_time in enumerate(rng.random(number + 1).tolist())]
+    pairs = list(zip(processes, processes[1:]))
+
+    def run():
+        for first, second in pairs:
+            first < second  # pylint: disable=pointless-statement
+    return run
+
+
+def bench_rand_exp_float(number: int) -> callable:
+    """Draw exponential samples one at a time"""
+    np.random.seed(SEED)
+
+    def run():
+        for _ in range(number):
+            rand_exp_float(BURST)
+    return run
+
+
+def bench_workload(number: int) -> callable:
+    """Draw processes from the chunked synthetic workload"""
+    def run():
+        workload = Workload(rate=10, burst_lambda=BURST, length=number,
+                            rng=np.random.default_rng(SEED))
+        for _ in range(number):
+            workload.next_process()
+    return run
+
+
+def bench_write_stats(number: int) -> callable:
+    """Write high level stats files, output is written to the current directory"""
+    Modeller.get_data_path(0).mkdir(parents=True, exist_ok=True)
+    stats = OnlineStats()
+    for i, run_time in enumerate(np.random.default_rng(SEED).random(1000).tolist()):
+        process = Process(run_time=run_time, process_id=i, created_at=float(i))
+        process.set_used(0.0, run_time)
+        process.set_completed(i + run_time * 2)
+        stats.append(process)
+    kwargs = {'stats': stats, 'path': 'bench', 'created_at': 0, 'length': stats.completed,
+              'usage': 500.0, 'avg_queue': 1.0, 'avg_in_system': 1.5,
+              'littles_law_error': 0.0, 'total_time': 1000.0, 'given_lambda': 1,
+              'burst_lambda': BURST, 'type': 1, 'label': 'bench', 'quantum': None,
+              'switches': 1000, 'switch_time': 0.0, 'cores': 1, 'migrations': 0,
+              'core_utilization': [0.5]}
+    modeller = Modeller()
+
+    def run():
+        for _ in range(number):
+            modeller.write_stats(**kwargs)
+    return run
+
+
+def bench_multilevel_queue(number: int) -> callable:
+    """Put then get one process on a three level queue holding QUEUE_DEPTH processes"""
+    queue = MultilevelQueue(3)
+    processes = [Process(run_time=BURST, process_id=i, created_at=float(i))
+                 for i in range(QUEUE_DEPTH + number)]
+    for i, process in enumerate(processes[:QUEUE_DEPTH]):
+        queue.put(process, i % 3)
+    pending = [(process, i % 3) for i, process in enumerate(processes[QUEUE_DEPTH:])]
+
+    def run():
+        put, get = queue.put, queue.get
+        for process, level in pending:
+            put(process, level)
+            get()
+    return run
+
+
+def print_result(name: str, result: dict, unit: str):
+    """Print one benchmark result"""
+    print('{0:<36} {1:>12.1f} ns/{2:<6} {3:>14,.0f} {2}s/sec'.format(
+        name, result['ns_per_op'], unit, result['ops_per_sec']))
+
+
+def run_benchmarks(length: int, repeat: int, ops: int) -> dict:
+    """
+    Run every benchmark in a scratch directory, as the simulation and
+    write_stats benchmarks write their output to the current directory
+    :param length: processes per simulation benchmark
+    :param repeat: repeats of each benchmark, the fastest counts
+    :param ops: operations per microbenchmark repeat
+    :return: dict of benchmark name to result
+    """
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            for policy in sorted(POLICIES.values(), key=lambda policy: policy.type):
+                for load, rho in LOADS.items():
+                    name = 'sim.{0}.{1}'.format(policy.name, load)
+                    results[name] = bench_simulation(policy, rho, length, repeat)
+                    print_result(name, results[name], 'event')
+
+            # Deep queue operations are slow enough that fewer of them are timed
+            deep = max(ops // 10, 1)
+            micro = (
+                ('event_queue.put_get', bench_event_queue(ops), ops),
+                ('priority_queue.put_get',
+                 bench_process_queue(PriorityProcessQueue(), ops), ops),
+                ('fifo_queue.put_get', bench_process_queue(FifoProcessQueue(), ops), ops),
+                ('multilevel_queue.put_get', bench_multilevel_queue(ops), ops),
+                ('response_ratio_queue.put_get', bench_response_ratio_queue(ops), ops),
+                ('response_ratio_queue.put_get.overload',
+                 bench_response_ratio_queue(deep, OVERLOAD_DEPTH), deep),
+                ('process.lt', bench_process_lt(ops), ops),
+                ('commons.rand_exp_float', bench_rand_exp_float(ops), ops),
+                ('workload.next_process', bench_workload(ops), ops),
+            )
+            for name, func, number in micro:
+                results[name] = measure(func, number, repeat)
+                print_result(name, results[name], 'op')
+
+            writes = max(ops // 100, 1)
+            results['modeller.write_stats'] = measure(bench_write_stats(writes), writes, repeat)
+            print_result('modeller.write_stats', results['modeller.write_stats'], 'call')
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def metadata() -> dict:
+    """Environment the benchmarks ran in, so results are only compared like for like"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(ROOT),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine()}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Print the change of every benchmark present in both result sets
+    :param baseline: results JSON of the reference run
+    :param current: results JSON of this run
+    :param threshold: relative slow down, e.g. 0.1 for 10%, above which a
+        benchmark counts as a regression
+    :return: list of names of the benchmarks that regressed
+    """
+    regressions = []
+    print('\nCompared to {} ({})'.format(baseline['meta'].get('commit'),
+                                        baseline['meta'].get('created_at')))
+    print('{0:<36} {1:>12} {2:>12} {3:>9}'.format('benchmark', 'before ns', 'after ns', 'change'))
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        change = result['ns_per_op'] / before['ns_per_op'] - 1
+        status = ''
+        if change > threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            status = 'faster'
+        print('{0:<36} {1:>12.1f} {2:>12.1f} {3:>+8.1%} {4}'.format(
+            name, before['ns_per_op'], result['ns_per_op'], change, status))
+    return regressions
+
+
+def main():
+    """Run the benchmarks, save them and compare against a baseline"""
+    parser = argparse.ArgumentParser(description='Benchmarks of the event loop and hot operations')
+    parser.add_argument('--output', type=str, default='benchmarks/results.json',
+                        help='JSON file the results are written to')
+    parser.add_argument('--compare', type=str, required=False, metavar='BASELINE',
+                        help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slow down reported as a regression, default 0.1')
+    parser.add_argument('--length', type=int, default=20000,
+                        help='processes per simulation benchmark, default 20000')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='repeats of each benchmark, the fastest counts, default 5')
+    parser.add_argument('--ops', type=int, default=100000,
+                        help='operations per microbenchmark repeat, default 100000')
+    args = parser.parse_args()
+
+    current = {'meta': metadata(),
+               'config': {'length': args.length, 'repeat': args.repeat, 'ops': args.ops},
+               'results': run_benchmarks(args.length, args.repeat, args.ops)}
+    with open(args.output, 'w') as file:
+        json.dump(current, file, indent=2, sort_keys=True)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('config') != current['config']:
+            print('Warning: baseline was run with {}'.format(baseline.get('config')))
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print('{} benchmarks regressed by more than {:.0%}'.format(
+                len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
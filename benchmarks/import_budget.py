@@ -0,0 +1,87 @@
+"""
+Import time budget of the simulation core.
+
+Every sweep worker imports the module its tasks run from before the first
+simulation starts, so for short runs startup is a large part of the total
+time.  This imports the worker's entry point in a fresh interpreter with
+python -X importtime and fails if it loads a module only plotting needs or
+takes longer than the budget.
+
+    python benchmarks/import_budget.py --budget 250
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# Entry point of the pool workers, see sweep.run_batch
+TARGET = 'src.sweep'
+# Heavy modules only plotting and analysis may import
+FORBIDDEN = ('pandas', 'matplotlib')
+
+
+def import_times(module: str) -> dict:
+    """
+    Import a module in a fresh interpreter
+    :param module: dotted module name
+    :return: dict of every module imported to its cumulative import time in microseconds
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=str(ROOT), stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def check(module: str, budget: float, repeat: int) -> list:
+    """
+    Check a module's startup cost
+    :param module: dotted module name
+    :param budget: maximum import time in milliseconds
+    :param repeat: number of imports, the fastest is compared to the budget
+    :return: list of failure messages, empty if the module is within budget
+    """
+    runs = [import_times(module) for _ in range(repeat)]
+    best = min(runs, key=lambda times: times[module])
+    failures = []
+    for name in FORBIDDEN:
+        if name in best:
+            failures.append('{} imports {}'.format(module, name))
+    elapsed = best[module] / 1000
+    heaviest = sorted(((cumulative, name) for name, cumulative in best.items()
+                       if '.' not in name and name != module), reverse=True)[:5]
+    print('{0} imports in {1:.1f} ms (budget {2:g} ms), {3} modules'.format(
+        module, elapsed, budget, len(best)))
+    for cumulative, name in heaviest:
+        print('  {0:>8.1f} ms  {1}'.format(cumulative / 1000, name))
+    if elapsed > budget:
+        failures.append('{0} took {1:.1f} ms to import, over the {2:g} ms budget'.format(
+            module, elapsed, budget))
+    return failures
+
+
+def main():
+    """Check the budget, exiting non-zero if it is exceeded"""
+    parser = argparse.ArgumentParser(description='Import time budget of the simulation core')
+    parser.add_argument('--module', default=TARGET,
+                        help='module to import, default the sweep worker entry point')
+    parser.add_argument('--budget', type=float, default=250.0,
+                        help='maximum import time in milliseconds, default 250')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of imports, the fastest counts, default 5')
+    args = parser.parse_args()
+
+    failures = check(args.module, args.budget, args.repeat)
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
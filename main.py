@@ -5,15 +5,18 @@ CPU Scheduler Simulator
 """
 import logging
 import argparse
-import concurrent.futures
 from pathlib import Path
 
 import numpy as np
 from arrow import utcnow, Arrow
 
+from src.cache import ResultCache
 from src.modeller import Modeller
-from src.sim import Simulator
-from src.commons.commons import SCHEDULE_TYPES
+from src.policies import get_policy, load_plugins
+from src.sweep import run_sim, run_sweep, expand_grid, load_spec, task_tag
+from src.tracer import event_type_number
+from src.commons.commons import make_seed
+from src.workload import Workload, trace_length, export_trace, trace_summary
 
 
 def create_logger(log_level: int, tag: str):
@@ -51,102 +54,358 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('runs', type=int, help='Number of trials')
     parser.add_argument('max_rate', type=int, help='max processes per second')
-    parser.add_argument('seed', type=int, help='base seed for PRNG. base_seed + rate')
-    verbose_help = 'Set Log level to debug.  Will use a lot of disk space'
+    parser.add_argument('seed', type=int, help='base seed for PRNG, combined with rate')
+    verbose_help = 'Set Log level to debug.  Will use a lot of disk space, ' \
+                   'see --event-trace for a compact binary trace'
     parser.add_argument('-v', '--verbose', action='store_true', help=verbose_help)
     parser.add_argument('-o', '--once',
                         action='store_true',
                         help='Run the simulation only once.  Uses special args')
-    parser.add_argument('--type', type=int, required=False, help='scheduler type [1-3]')
+    parser.add_argument('--type', type=str, required=False,
+                        help='scheduler type number [1-6] or name, e.g. MLFQ')
     parser.add_argument('--service_time', type=float, required=False, help='average svc time')
     parser.add_argument('--quantum', type=float, required=False, help='quantum value (sec)')
+    common_help = 'Generate each rate\'s workload once and replay it from a shared ' \
+                  'memory-mapped trace in every scheduler'
+    parser.add_argument('--common-workload', action='store_true', help=common_help)
+    parser.add_argument('--trace', type=str, required=False,
+                        help='replay a recorded .csv or .npy (arrival, burst) trace at its '
+                             'own arrival rate and burst, instead of the rate and burst grid')
+    parser.add_argument('--export-trace', choices=('csv', 'npy'), required=False,
+                        help='save each rate\'s synthetic workload in the given format')
+    parser.add_argument('--raw-format', choices=('csv', 'npy', 'none'), default='csv',
+                        help='format of streamed raw per-process output, or none')
+    parser.add_argument('--precision', type=float, required=False,
+                        help='stop each sim once the 95%% CI half-width of turnaround time '
+                             'is within this fraction of the mean (runs is then the maximum)')
+    parser.add_argument('--warmup', type=int, default=1000,
+                        help='processes discarded before batch means start')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='processes per batch for batch means')
+    parser.add_argument('--workers', type=int, required=False,
+                        help='number of worker processes, defaults to the cpu count')
+    parser.add_argument('--chunksize', type=int, default=1,
+                        help='number of simulations per pool task')
+    parser.add_argument('--spec', type=str, required=False,
+                        help='JSON sweep spec of schedulers, rates, quanta and burst_lambdas')
+    parser.add_argument('--schedulers', type=str, required=False,
+                        help='comma separated schedulers to sweep, '
+                             'from FCFS,SJF,SRTF,HRRN,RR,MLFQ')
+    parser.add_argument('--rates', type=str, required=False,
+                        help='comma separated arrival rates, replaces 1..max_rate')
+    parser.add_argument('--log-rates', type=str, required=False, metavar='START:STOP:NUM',
+                        help='NUM log-spaced arrival rates from START to STOP')
+    parser.add_argument('--quanta', type=str, required=False,
+                        help='comma separated quanta for quantum based schedulers')
+    parser.add_argument('--bursts', type=str, required=False,
+                        help='comma separated average burst times')
+    parser.add_argument('--mlfq-levels', type=int, required=False,
+                        help='number of MLFQ levels, default 3')
+    parser.add_argument('--mlfq-quanta', type=str, required=False,
+                        help='comma separated quantum of each MLFQ level, '
+                             'default the quantum doubling per level')
+    parser.add_argument('--mlfq-boost', type=float, required=False,
+                        help='seconds between MLFQ priority boosts, 0 to never boost, default 1')
+    parser.add_argument('--switch-cost', type=float, default=0.0,
+                        help='mean seconds a context switch takes, default 0')
+    parser.add_argument('--switch-distribution', choices=('constant', 'exponential'),
+                        default='constant', help='distribution of context switch costs')
+    parser.add_argument('--cores', type=str, required=False,
+                        help='comma separated numbers of CPUs to sweep, default 1')
+    parser.add_argument('--per-core', action='store_true',
+                        help='give each CPU its own run queue with work stealing '
+                             'instead of one global run queue')
+    parser.add_argument('--io-bursts', type=float, default=1.0,
+                        help='mean number of CPU bursts per process, with I/O '
+                             'between them, default 1 for no I/O')
+    parser.add_argument('--io-time', type=float, default=0.05,
+                        help='mean seconds an I/O burst takes, default 0.05')
+    parser.add_argument('--io-devices', type=int, default=1,
+                        help='number of I/O requests served at once, 0 for unlimited, default 1')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='recompute every simulation instead of reusing cached results')
+    parser.add_argument('--cache-dir', type=str, default='{}/cache'.format(Modeller.ABS_PATH),
+                        help='directory of the result cache')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='maximum size of the result cache in MB')
+    parser.add_argument('--no-cache-raw', action='store_true',
+                        help='do not cache raw per-process output, runs writing it '
+                             'are then always recomputed')
+    parser.add_argument('--instrument', action='store_true',
+                        help='count and time events by type and track peak queue depths, '
+                             'written to data/<tag>/<run>.counters.json')
+    parser.add_argument('--profile', action='store_true',
+                        help='run each simulation under cProfile, '
+                             'written to data/<tag>/<run>.pstats')
+    parser.add_argument('--event-trace', action='store_true',
+                        help='trace every event as (time, type, pid, queue length, core) '
+                             'to a binary data/<tag>/raw_data/<run>.trace.npy, '
+                             'see read_trace.py')
+    parser.add_argument('--event-trace-sample', type=int, default=1,
+                        help='trace every Nth matching event, default 1')
+    parser.add_argument('--event-trace-types', type=str, required=False,
+                        help='comma separated event types to trace, e.g. NEW,COMPLETE, '
+                             'default all')
+    parser.add_argument('--event-trace-buffer', type=int, default=65536,
+                        help='events buffered between writes, default 65536')
+    parser.add_argument('--event-trace-ring', action='store_true',
+                        help='keep only the last --event-trace-buffer events of each run')
+    parser.add_argument('--plot-every', type=int, default=0,
+                        help='redraw the plots after every N finished runs, '
+                             'default 0 to plot once the sweep is done')
+    parser.add_argument('--plot-formats', type=str, default='png,svg',
+                        help='comma separated plot file formats, default png,svg')
+    parser.add_argument('--plugin', action='append', default=[], metavar='MODULE',
+                        help='import a module registering extra scheduling policies')
     args = parser.parse_args()
+    # Workers import them again, see sweep.run_sweep
+    load_plugins(args.plugin)
+    if args.raw_format == 'none':
+        args.raw_format = None
 
     start = utcnow()
     length = args.runs
-    rates = [i + 1 for i in range(args.max_rate)]
-    results = []
 
     # Configure Logger
     level = logging.DEBUG if args.verbose else logging.INFO
     create_logger(log_level=level, tag=str(start.timestamp))
 
     if args.once:
-        results.append(run_once(args, start))
+        run_once(args, start)
     else:
 
+        spec = build_spec(args)
+        if args.trace:
+            # A recorded trace fixes the workload, so only one rate and burst is simulated
+            rate, burst_lambda = trace_summary(args.trace)
+            if args.rates or args.log_rates or args.bursts:
+                message = 'Ignoring the rate and burst grid, --trace {0} runs at ' \
+                          'rate {1} burst {2}'.format(args.trace, rate, burst_lambda)
+                logging.warning(message)
+                print(message)
+            spec['rates'] = [rate]
+            spec['burst_lambdas'] = [burst_lambda]
+        grid = expand_grid(spec)
+        workloads = sorted({(cell['rate'], cell['burst_lambda']) for cell in grid})
+
+        traces = {}
+        tag = str(start.timestamp)
+        if args.export_trace:
+            create_traces(tag, workloads, length, args.seed, fmt=args.export_trace)
+        if args.common_workload:
+            traces = create_traces(tag, workloads, length, args.seed)
+        if args.trace:
+            traces = {workload: args.trace for workload in workloads}
+
+        tasks = []
+        for cell in grid:
+            task = dict(cell,
+                        prefix=start,
+                        length=length,
+                        raw_format=args.raw_format,
+                        steady_state=steady_state_config(args),
+                        switch_cost=args.switch_cost,
+                        switch_distribution=args.switch_distribution,
+                        per_core=args.per_core,
+                        io=io_config(args),
+                        instrument=args.instrument,
+                        profile=args.profile,
+                        event_trace=event_trace_config(args),
+                        # This ensures a consistent workload is used across schedule methods
+                        seed=make_seed(args.seed, cell['rate']),
+                        trace=traces.get((cell['rate'], cell['burst_lambda'])))
+            tasks.append(task)
+
+        # Imported here so pool workers never load pandas or matplotlib
+        from src.plots import IncrementalPlotter  # pylint: disable=import-outside-toplevel
+        plotter = IncrementalPlotter(Modeller.get_plot_path(tag),
+                                     args.plot_formats.split(','),
+                                     args.plot_every)
+
+        cache = None
+        # Common workloads are generated from the seed, so the seed identifies them
+        derived = args.common_workload and not args.trace
+        # Cached results would skip the runs being measured or traced
+        if not (args.no_cache or args.instrument or args.profile or args.event_trace):
+            cache = ResultCache(args.cache_dir, args.cache_size << 20,
+                                not args.no_cache_raw)
+            tasks, restored = restore_cached(cache, tasks, tag, derived)
+            logging.info('Restored %s results from cache', len(restored))
+            for task, path in restored:
+                record_result(tag, task, path, plotter)
+
         print('Sim running, please be patient')
-        # Use a process pool to run simulations simultaneously
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            for key, value in SCHEDULE_TYPES.items():
-                kwargs = {
-                    'method': value,
-                    'prefix': start,
-                    'quantum': 0.01,
-                    'rate': None,
-                    'length': length
-                }
-
-                for rate in rates:
-                    # This ensures a consistent seed is used across schedule methods
-                    np.random.seed(int(str(args.seed) + str(rate)))
-                    kwargs['rate'] = rate
-                    results.append(executor.submit(run_sim, **kwargs))
-
-                # Run everything again for RR with the second quantum value
-                if key == 'RR':
-                    kwargs['quantum'] = 0.2
-                    for rate in rates:
-                        np.random.seed(int(str(args.seed) + str(rate)))
-                        kwargs['rate'] = rate
-                        results.append(executor.submit(run_sim, **kwargs))
-
-    # Get the path to high level stats and plot them
-    if not args.once:
-        data = results[0].result()
-        generate_plots(data)
-        print('Plot is at {}/plots/plot.png'.format(str(data.parent)))
+        # Longest tasks go first, results stream back as each one finishes
+        for i, (task, path) in enumerate(run_sweep(tasks, args.workers, args.chunksize,
+                                                     args.plugin)):
+            record_result(tag, task, path, plotter)
+            if cache:
+                cache.store(ResultCache.key(task, derived), task, path)
+            logging.info('Finished %s/%s: type %s rate %s quantum %s burst %s cores %s',
+                         i + 1, len(tasks), task['method'], task['rate'], task['quantum'],
+                         task['burst_lambda'], task['cores'])
+
+        plots = plotter.draw()
+        if plots:
+            print('Plot is at {}'.format(plots[0]))
 
     message = "Sim done, execution time: {}".format((utcnow() - start).total_seconds())
     print(message)
     logging.info(message)
 
 
-def generate_plots(path: Path):
+def build_spec(args) -> dict:
+    """
+    Build the sweep spec from a --spec file overridden by CLI grid arguments
+    :param args: parsed arguments
+    :return: spec dict, see sweep.load_spec
+    """
+    spec = load_spec(args.spec) if args.spec else {}
+    spec.setdefault('rates', [i + 1 for i in range(args.max_rate)])
+    if args.schedulers:
+        spec['schedulers'] = args.schedulers.split(',')
+    if args.rates:
+        spec['rates'] = [float(rate) for rate in args.rates.split(',')]
+    if args.log_rates:
+        rate_start, rate_stop, num = args.log_rates.split(':')
+        spec['rates'] = {'start': float(rate_start),
+                         'stop': float(rate_stop),
+                         'num': int(num),
+                         'log': True}
+    if args.quanta:
+        spec['quanta'] = [float(quantum) for quantum in args.quanta.split(',')]
+    if args.bursts:
+        spec['burst_lambdas'] = [float(burst) for burst in args.bursts.split(',')]
+    if args.cores:
+        spec['cores'] = [int(cores) for cores in args.cores.split(',')]
+    options = spec.setdefault('options', {})
+    mlfq = mlfq_options(args)
+    if mlfq:
+        options['MLFQ'] = dict(options.get('MLFQ', {}), **mlfq)
+    return spec
+
+
+def mlfq_options(args) -> dict:
+    """
+    Build MLFQ policy options from the CLI
+    :param args: parsed arguments
+    :return: dict of the options given, see policies.MultilevelFeedbackQueue
+    """
+    options = {}
+    if args.mlfq_levels is not None:
+        options['levels'] = args.mlfq_levels
+    if args.mlfq_quanta:
+        options['quanta'] = [float(quantum) for quantum in args.mlfq_quanta.split(',')]
+    if args.mlfq_boost is not None:
+        options['boost'] = args.mlfq_boost or None
+    return options
+
+
+def io_config(args) -> dict:
+    """
+    Build Simulator I/O burst config from the CLI
+    :param args: parsed arguments
+    :return: dict of bursts, time and devices, or None without I/O
+    """
+    if args.io_bursts <= 1:
+        return None
+    return {'bursts': args.io_bursts, 'time': args.io_time, 'devices': args.io_devices}
+
+
+def event_trace_config(args) -> dict:
+    """
+    Build Simulator event trace options from the CLI
+    :param args: parsed arguments
+    :return: tracer.EventTracer keyword arguments, or None without --event-trace
+    """
+    if not args.event_trace:
+        return None
+    types = None
+    if args.event_trace_types:
+        types = sorted({event_type_number(name) for name in args.event_trace_types.split(',')})
+    return {'capacity': args.event_trace_buffer,
+            'sample': args.event_trace_sample,
+            'types': types,
+            'ring': args.event_trace_ring}
+
+
+def steady_state_config(args) -> dict:
     """
-    generate dataframes from individual columns with burst lambda
-    :param: path: Path to stats directory
+    Build Simulator steady_state arguments from the CLI
+    :param args: parsed arguments
+    :return: BatchMeans keyword arguments, or None if no precision was given
     """
-    runs = list(path.glob('**/high*.csv'))
-    Modeller.plot(runs)
+    if args.precision is None:
+        return None
+    return {'warmup': args.warmup, 'batch_size': args.batch_size, 'precision': args.precision}
 
 
-def run_sim(method: int,
-            prefix: Arrow,
-            rate: int,
-            length: int,
-            quantum: float = None) -> Path:
+def restore_cached(cache: ResultCache, tasks: list, tag: str, trace_derived: bool) -> tuple:
     """
-    run sim with given parameters
-    :param method: scheduler method from commons.SCHEDULE_TYPES
-    :param prefix: folder prefix for data, usually unix timestamp
-    :param rate: rate of process arrival
+    Copy cached results into this sweep's data directory
+    :param cache: result cache
+    :param tasks: list of run_sim keyword argument dicts
+    :param tag: Sim grouping tag (unix timestamps)
+    :param trace_derived: True if task traces were generated from their seeds
+    :return: (tasks still to run, (task, Path) of restored results)
+    """
+    missing, restored = [], []
+    for task in tasks:
+        path = cache.restore(ResultCache.key(task, trace_derived), task, tag)
+        if path is None:
+            missing.append(task)
+        else:
+            restored.append((task, path))
+    return missing, restored
+
+
+def record_result(tag: str, task: dict, path: Path, plotter):
+    """
+    Add a finished run to the sweep's results file and plots
+    :param tag: Sim grouping tag (unix timestamps)
+    :param task: run_sim keyword arguments
+    :param path: the run's data directory, as returned by run_sim
+    :param plotter: plots.IncrementalPlotter of the sweep
+    """
+    row = Modeller.read_stats(path / 'high_{}.csv'.format(task_tag(task)))
+    Modeller.append_results(tag, row)
+    plotter.add(row)
+
+
+def create_traces(tag: str, workloads: list, length: int, seed: int, fmt: str = 'npy') -> dict:
+    """
+    Generate one shared workload trace per rate and burst for every scheduler to replay
+    :param tag: Sim grouping tag (unix timestamps)
+    :param workloads: (rate, burst_lambda) pairs to generate
     :param length: length of simulation in processes
-    :param quantum: time quantum (only for round robin)
-    :return: Path to high level stats
+    :param seed: base seed for PRNG
+    :param fmt: trace file format, npy or csv
+    :return: dict of (rate, burst_lambda) to trace path
     """
-    return Simulator(
-        method=method,
-        created_at=prefix,
-        quantum=quantum,
-        process_rate=rate,
-        length=length
-    ).run()
+    trace_path = Modeller.get_workload_path(tag)
+    if not trace_path.exists():
+        trace_path.mkdir(parents=True)
+
+    traces = {}
+    for rate, burst_lambda in workloads:
+        workload = Workload(rate=rate,
+                            burst_lambda=burst_lambda,
+                            length=length,
+                            rng=np.random.default_rng(make_seed(seed, rate)))
+        path = trace_path / 'rate{0}_burst{1}.{2}'.format(rate, burst_lambda, fmt)
+        rows = trace_length(length, rate, burst_lambda)
+        traces[(rate, burst_lambda)] = str(export_trace(path, workload, rows))
+        logging.info('Wrote shared workload %s (%s rows)', path, rows)
+    return traces
 
 
 def run_once(args, start: Arrow) -> Path:
     """Run simulation once with given values"""
-    members = (args.type, args.max_rate, args.service_time, args.quantum)
+    policy = get_policy(int(args.type) if args.type.isdigit() else args.type)
+    rate, service_time = args.max_rate, args.service_time or 0.06
+    if args.trace:
+        rate, service_time = trace_summary(args.trace)
+    members = (policy.title, rate, service_time, args.quantum)
     message = 'Running Sim with values\n' \
               'Type:\t{0}\n' \
               'Rate\t{1}\n' \
@@ -155,11 +414,25 @@ def run_once(args, start: Arrow) -> Path:
     logging.info(message)
     print(message)
 
-    return run_sim(method=args.type,
+    return run_sim(method=policy.type,
                    prefix=start,
+                   burst_lambda=service_time,
                    quantum=args.quantum,
-                   rate=args.max_rate,
-                   length=args.runs)
+                   rate=rate,
+                   length=args.runs,
+                   seed=make_seed(args.seed, rate),
+                   trace=args.trace,
+                   raw_format=args.raw_format,
+                   steady_state=steady_state_config(args),
+                   options=mlfq_options(args) if policy.name == 'MLFQ' else None,
+                   switch_cost=args.switch_cost,
+                   switch_distribution=args.switch_distribution,
+                   cores=int(args.cores) if args.cores else 1,
+                   per_core=args.per_core,
+                   io=io_config(args),
+                   instrument=args.instrument,
+                   profile=args.profile,
+                   event_trace=event_trace_config(args))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+"""
+Decode binary event traces written with main.py --event-trace
+
+    python read_trace.py data/<tag>/raw_data/<run>.trace.npy --summary
+    python read_trace.py <trace> --types COMPLETE --pid 42 --csv
+"""
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+from src.tracer import event_type_number, load_trace
+
+
+def select(records: np.ndarray, args) -> np.ndarray:
+    """
+    Filter trace rows by the CLI options
+    :param records: structured array of tracer.EventTracer.DTYPE
+    :param args: parsed arguments
+    :return: matching rows
+    """
+    mask = np.ones(len(records), dtype=bool)
+    if args.types:
+        types = [event_type_number(name) for name in args.types.split(',')]
+        mask &= np.isin(records['event_type'], types)
+    if args.pid is not None:
+        mask &= records['pid'] == args.pid
+    if args.core is not None:
+        mask &= records['core'] == args.core
+    if args.start is not None:
+        mask &= records['time'] >= args.start
+    if args.end is not None:
+        mask &= records['time'] < args.end
+    rows = records[mask]
+    return rows[:args.head] if args.head else rows
+
+
+def summarize(rows: np.ndarray, meta: dict, names: dict):
+    """Print event counts by type, time span and queue length of the selected rows"""
+    print('rows {0}, sampled 1 in {1}, {2} events seen, {3} dropped by the ring'.format(
+        len(rows), meta.get('sample', 1), meta.get('seen', '?'), meta.get('dropped', 0)))
+    if not len(rows):
+        return
+    print('time {0:.6f} to {1:.6f}'.format(rows['time'][0], rows['time'][-1]))
+    print('queue length mean {0:.3f} max {1}'.format(
+        rows['queue_len'].mean(), rows['queue_len'].max()))
+    types, counts = np.unique(rows['event_type'], return_counts=True)
+    for event_type, number in zip(types.tolist(), counts.tolist()):
+        print('{0:<12} {1:>10}'.format(names.get(event_type, event_type), number))
+
+
+def main():
+    """Print a trace file, or a summary of it"""
+    parser = argparse.ArgumentParser(description='Decode binary event traces')
+    parser.add_argument('trace', help='.trace.npy file written by --event-trace')
+    parser.add_argument('--types', type=str, required=False,
+                        help='comma separated event types to show, e.g. NEW,COMPLETE')
+    parser.add_argument('--pid', type=int, required=False, help='only this process')
+    parser.add_argument('--core', type=int, required=False, help='only this core')
+    parser.add_argument('--start', type=float, required=False,
+                        help='only events at or after this simulation time')
+    parser.add_argument('--end', type=float, required=False,
+                        help='only events before this simulation time')
+    parser.add_argument('--head', type=int, required=False, help='only the first N rows')
+    parser.add_argument('--summary', action='store_true',
+                        help='print counts by event type instead of rows')
+    parser.add_argument('--csv', action='store_true', help='print rows as csv')
+    args = parser.parse_args()
+
+    records, meta = load_trace(args.trace)
+    names = {int(event_type): name
+             for event_type, name in meta.get('event_types', {}).items()}
+    rows = select(records, args)
+    if args.summary:
+        summarize(rows, meta, names)
+        return
+
+    columns = rows.dtype.names
+    if args.csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(columns)
+    else:
+        print('{0:>14} {1:<12} {2:>10} {3:>9} {4:>5}'.format(*columns))
+    for row in rows.tolist():
+        row = (row[0], names.get(row[1], row[1])) + row[2:]
+        if args.csv:
+            writer.writerow(row)
+        else:
+            print('{0:>14.6f} {1:<12} {2:>10} {3:>9} {4:>5}'.format(*row))
+
+
+if __name__ == '__main__':
+    main()
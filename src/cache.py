@@ -0,0 +1,202 @@
+"""Content addressed cache of simulation results"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import arrow
+import numpy as np
+
+from src.modeller import Modeller
+from src.stats import rebase_raw_csv
+from src.sweep import task_tag
+
+_CODE_VERSION = None
+
+
+def code_version() -> str:
+    """
+    Hash of every source file of the simulator, so results are never
+    reused across code changes
+    :return: hex digest
+    """
+    global _CODE_VERSION  # pylint: disable=global-statement
+    if _CODE_VERSION is None:
+        digest = hashlib.sha256()
+        root = Path(__file__).parent
+        for path in sorted(root.glob('**/*.py')):
+            digest.update(str(path.relative_to(root)).encode())
+            digest.update(path.read_bytes())
+        _CODE_VERSION = digest.hexdigest()
+    return _CODE_VERSION
+
+
+def _seed_identity(seed):
+    """JSON friendly identity of a seed, None if it is not reproducible"""
+    if isinstance(seed, np.random.SeedSequence):
+        return [seed.entropy, list(seed.spawn_key)]
+    if isinstance(seed, (int, np.integer)):
+        return int(seed)
+    return None
+
+
+def _trace_identity(trace):
+    """Identity of a recorded trace file by path, size and modification time"""
+    stat = os.stat(str(trace))
+    return [str(Path(str(trace)).resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+class ResultCache:
+    """
+    Cache of finished simulations keyed by a hash of their parameters.
+
+    Each entry is a directory holding the high level stats csv and the raw
+    per-process output of runs that write it.  An entry missing the raw
+    output a run asks for is a miss, so a hit never loses output the
+    simulation would have written.  csv raw output holds wall-clock times,
+    so it is stored with the epoch of the run that wrote it and moved to
+    the restoring run's epoch.  Entries are touched on every
+    hit and the least recently used are evicted once the cache grows past
+    max_bytes.
+
+    Attributes:
+        root: directory entries are stored in
+        max_bytes: size the cache is trimmed to after a store
+        keep_raw: cache raw per-process output, without it runs writing raw
+            output are never restored
+    """
+    HIGH_FILE = 'high.csv'
+    EPOCH_FILE = 'epoch'
+
+    def __init__(self, root: str = '{}/cache'.format(Modeller.ABS_PATH),
+                 max_bytes: int = 1 << 30,
+                 keep_raw: bool = True):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.keep_raw = keep_raw
+        if not self.root.exists():
+            self.root.mkdir(parents=True)
+
+    @staticmethod
+    def key(task: dict, trace_derived: bool = False) -> str:
+        """
+        Hash of the simulation config, scheduler, seed and code version
+        :param task: run_sim keyword arguments
+        :param trace_derived: True if the task's trace was generated from its
+            seed, so the trace file itself does not identify the workload
+        :return: hex digest, or None if the task is not reproducible
+        """
+        seed = _seed_identity(task.get('seed'))
+        trace = task.get('trace')
+        if trace is not None and not trace_derived:
+            identity = _trace_identity(trace)
+        elif seed is None:
+            return None
+        else:
+            identity = None
+
+        config = {
+            'method': task['method'],
+            'rate': task['rate'],
+            'length': task['length'],
+            'quantum': task.get('quantum'),
+            'burst_lambda': task.get('burst_lambda'),
+            'steady_state': task.get('steady_state'),
+            'options': task.get('options'),
+            'switch_cost': task.get('switch_cost'),
+            'switch_distribution': task.get('switch_distribution'),
+            'cores': task.get('cores'),
+            'per_core': task.get('per_core'),
+            'io': task.get('io'),
+            'seed': seed,
+            'trace': identity,
+            'code': code_version()
+        }
+        encoded = json.dumps(config, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def restore(self, key: str, task: dict, identifier: str) -> Path:
+        """
+        Copy a cached result into a run's data directory
+        :param key: cache key from ResultCache.key
+        :param task: run_sim keyword arguments
+        :param identifier: Sim grouping tag (unix timestamps)
+        :return: Path to the run's data directory, None on a miss
+        """
+        if key is None:
+            return None
+        entry = self.root / key
+        high = entry / ResultCache.HIGH_FILE
+        raw_format = task.get('raw_format')
+        raw = entry / 'raw.{}'.format(raw_format)
+        epoch = entry / ResultCache.EPOCH_FILE
+        if not high.exists() or (raw_format and not raw.exists()) or \
+                (raw_format == 'csv' and not epoch.exists()):
+            return None
+
+        tag = task_tag(task)
+        data_path = Modeller.get_data_path(identifier)
+        shutil.copyfile(str(high), str(data_path / 'high_{}.csv'.format(tag)))
+        if raw_format == 'csv':
+            rebase_raw_csv(raw, Modeller.get_raw_path(identifier, tag, raw_format),
+                           arrow.get(epoch.read_text()), task['prefix'])
+        elif raw_format:
+            shutil.copyfile(str(raw), str(Modeller.get_raw_path(identifier, tag, raw_format)))
+
+        # Mark as recently used for eviction
+        os.utime(str(entry))
+        logging.info('Cache hit %s for %s', key, tag)
+        return data_path
+
+    def store(self, key: str, task: dict, data_path: Path):
+        """
+        Save a finished simulation's results
+        :param key: cache key from ResultCache.key
+        :param task: run_sim keyword arguments
+        :param data_path: the run's data directory, as returned by run_sim
+        """
+        if key is None:
+            return
+        tag = task_tag(task)
+        entry = self.root / key
+        # Unique per store, sweeps sharing a cache may store the same key at once
+        partial = Path(tempfile.mkdtemp(prefix='{}.'.format(key), suffix='.part',
+                                        dir=str(self.root)))
+        shutil.copyfile(str(data_path / 'high_{}.csv'.format(tag)),
+                        str(partial / ResultCache.HIGH_FILE))
+        raw_format = task.get('raw_format')
+        raw = data_path / '{0}.{1}'.format(tag, raw_format)
+        if self.keep_raw and raw_format and raw.exists():
+            shutil.copyfile(str(raw), str(partial / 'raw.{}'.format(raw_format)))
+            (partial / ResultCache.EPOCH_FILE).write_text(task['prefix'].isoformat())
+
+        if entry.exists():
+            shutil.rmtree(str(entry), ignore_errors=True)
+        try:
+            partial.rename(entry)
+        except OSError:
+            # Another sweep stored the same result in between, keep theirs
+            shutil.rmtree(str(partial))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for entry in self.root.iterdir():
+            # Stores still being written are not entries yet
+            if not entry.is_dir() or entry.name.endswith('.part'):
+                continue
+            size = sum(path.stat().st_size for path in entry.iterdir())
+            entries.append((entry.stat().st_mtime, size, entry))
+            total += size
+
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(str(entry))
+            total -= size
+            logging.info('Evicted cache entry %s', entry.name)
@@ -1,28 +1,87 @@
 """Helper Functions"""
+import struct
+
 import numpy as np
 
 SCHEDULE_TYPES = {
     'FCFS': 1,
     'SJF': 2,
-    'RR': 3
+    'RR': 3,
+    'SRTF': 4,
+    'HRRN': 5,
+    'MLFQ': 6
 }
 
 EVENT_TYPES = {
     'NEW': 1,
     'COMPLETE': 2,
-    'SWITCH': 3
+    'SWITCH': 3,
+    'IO_COMPLETE': 4
+}
+# Name of each event type, for reports
+EVENT_NAMES = {event_type: name for name, event_type in EVENT_TYPES.items()}
+
+PROCESS_STATES = {
+    'READY': 1,
+    'RUNNING': 2,
+    'BLOCKED': 3,
+    'DONE': 4
 }
 
 
+def exp_scale(given_lambda: float) -> float:
+    """
+    Scale (mean) of the exponential distribution used for a given lambda.
+    Values above 1 are treated as rates, values at or below 1 as means.
+    :param given_lambda: lambda for exponential distribution
+    :return: scale parameter for numpy's exponential
+    """
+    if given_lambda > 1:
+        return 1/given_lambda
+    return given_lambda
+
+
 def rand_exp_float(given_lambda: float) -> float:
     """
     Generate a random number that follows an exponential distribution
     :param given_lambda: lambda for exponential distribution
     :return pseudo-random number following exp distribution
     """
-    if given_lambda > 1:
-        given_lambda = 1/given_lambda
-    return np.random.exponential(scale=given_lambda)
+    return np.random.exponential(scale=exp_scale(given_lambda))
+
+
+def make_seed(base_seed: int, rate: float) -> np.random.SeedSequence:
+    """
+    Build the seed for one simulation.
+    Every scheduler run at the same rate gets the same seed, and so replays
+    the exact same workload regardless of which worker process runs it.
+    :param base_seed: base seed given on the command line
+    :param rate: process arrival rate of the simulation
+    :return: SeedSequence to build a numpy Generator from
+    """
+    # Spawn keys must be integers, the rate's float bits give every distinct rate its own
+    key = struct.unpack('<Q', struct.pack('<d', float(rate)))[0]
+    return np.random.SeedSequence(entropy=base_seed, spawn_key=(key,))
+
+
+def run_tag(schedule_type: int,
+            burst_lambda: float,
+            rate: float,
+            quantum: float = None,
+            cores: int = 1) -> str:
+    """
+    Unique file tag of a single simulation within a sweep
+    :param schedule_type: scheduler method from SCHEDULE_TYPES
+    :param burst_lambda: average process execution time
+    :param rate: rate of process arrival
+    :param quantum: time quantum, None for non quantum schedulers
+    :param cores: number of CPUs, only tagged when more than one
+    :return: tag such as 'type3_burst0.06_rate10_quantum0.01'
+    """
+    tag = 'type{0}_burst{1}_rate{2}_quantum{3}'.format(schedule_type, burst_lambda, rate, quantum)
+    if cores and cores > 1:
+        tag += '_cores{}'.format(cores)
+    return tag
 
 
 def calc_high_level_stats(turnaround_time: float,
@@ -31,38 +90,31 @@ def calc_high_level_stats(turnaround_time: float,
                           usage: float,
                           total_time: float,
                           given_lambda: int,
+                          avg_queue: float,
                           **kwargs):
     """
     Write high level stats
     # 1) AVERAGE TURNAROUND TIME
     # 2) TOTAL THROUGHPUT
     # 3) CPU UTILIZATION
-    # 4) AVERAGE # OF PROCESSES IN READY QUEUE
+    # 4) AVERAGE # OF PROCESSES IN READY QUEUE (time-weighted)
     :param turnaround_time: Total Run time / Number of Processes
     :param wait_time: Total wait time of all processes
     :param length: Number of Processes
     :param usage: Total CPU usage in seconds
     :param total_time: Total simulation time in seconds
     :param given_lambda: process arrival rate
+    :param avg_queue: time-average ready queue length
+    :param label: scheduler label from the run's policy, see policies.Policy.label
     :return: tuple to be written to csv
     """
     utilization = usage / total_time
     throughput = length / total_time
-    int_schedule_type = kwargs.get('type')
-    if int_schedule_type == SCHEDULE_TYPES['FCFS']:
-        schedule_type = 'First Come First Served'
-    elif int_schedule_type == SCHEDULE_TYPES['SJF']:
-        schedule_type = 'Shortest Job First'
-    elif int_schedule_type == SCHEDULE_TYPES['RR'] and kwargs.get('quantum') == 0.01:
-        schedule_type = 'Round Robin 0.01'
-    elif int_schedule_type == SCHEDULE_TYPES['RR'] and kwargs.get('quantum') == 0.2:
-        schedule_type = 'Round Robin 0.2'
-    else:
-        schedule_type = 'Unknown'
+    schedule_type = kwargs.get('label', 'Unknown')
 
     return (schedule_type,
             given_lambda,
             turnaround_time / length,
             throughput,
             utilization,
-            (1/given_lambda) * wait_time)
+            avg_queue)
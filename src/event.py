@@ -1,26 +1,36 @@
 """Event class"""
-from arrow import Arrow, utcnow
-
 from src.process import Process
 
 
 class Event:
     """
     Basic Event class
+
+    Timer events (COMPLETE, SWITCH) carry the core they were armed on and
+    that core's generation.  Bumping a core's generation invalidates its
+    outstanding timers in O(1); stale events are skipped when popped.
     """
+    __slots__ = ('created_at', 'event_type', 'process', 'generation', 'core')
+
     def __init__(self,
-                 created_at: Arrow = utcnow(),
+                 created_at: float = 0.0,
                  event_type: int = None,
-                 process: Process = None):
+                 process: Process = None,
+                 generation: int = None,
+                 core: int = None):
         """
         Event Constructor
-        :param created_at:
+        :param created_at: simulation time (sec) the event fires at
         :param event_type:
         :param process:
+        :param generation: core generation for timer events, None if never stale
+        :param core: index of the core a timer event was armed on
         """
         self.created_at = created_at
         self.event_type = event_type
         self.process = process
+        self.generation = generation
+        self.core = core
 
     def __lt__(self, other):
         """Implement comparable"""
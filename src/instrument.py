@@ -0,0 +1,107 @@
+"""Optional event loop instrumentation"""
+import json
+import logging
+from pathlib import Path
+from time import perf_counter
+
+from src.commons.commons import EVENT_NAMES
+
+
+class Instrumentation:
+    """
+    Counters and timers of a Scheduler's event loop.
+
+    attach rebinds the scheduler's process_event and check_running_process
+    to timed wrappers on that one instance, so a scheduler that is never
+    instrumented runs the plain methods with no overhead at all.
+
+    Attributes:
+        counts: dict of event type name to number of events handled
+        handler_time: dict of event type name to wall seconds spent handling them
+        dispatches: number of check_running_process calls
+        dispatch_time: wall seconds spent in check_running_process, policy
+            pick_next and work stealing
+        peaks: dict of the highest event queue, ready queue, in system,
+            blocked and I/O queue depths seen after any event
+        loop_time: wall seconds of the whole event loop
+        offload_time: wall seconds spent offloading and writing stats
+    """
+    def __init__(self):
+        self.counts = {}
+        self.handler_time = {}
+        self.dispatches = 0
+        self.dispatch_time = 0.0
+        self.peaks = {'event_queue': 0,
+                      'ready_queue': 0,
+                      'in_system': 0,
+                      'blocked': 0,
+                      'io_queue': 0}
+        self.loop_time = 0.0
+        self.offload_time = 0.0
+
+    def attach(self, scheduler):
+        """
+        Time every event and dispatch of a scheduler
+        :param scheduler: Scheduler to instrument
+        """
+        names = EVENT_NAMES
+        process_event = scheduler.process_event
+        check_running_process = scheduler.check_running_process
+        counts, handler_time, peaks = self.counts, self.handler_time, self.peaks
+
+        def timed_process_event(event):
+            start = perf_counter()
+            process_event(event)
+            elapsed = perf_counter() - start
+            name = names.get(event.event_type, str(event.event_type))
+            counts[name] = counts.get(name, 0) + 1
+            handler_time[name] = handler_time.get(name, 0.0) + elapsed
+
+        def timed_check_running_process():
+            start = perf_counter()
+            check_running_process()
+            self.dispatch_time += perf_counter() - start
+            self.dispatches += 1
+            depths = (('event_queue', len(scheduler.event_queue)),
+                      ('ready_queue', sum(len(policy.queue) for policy in scheduler.policies)),
+                      ('in_system', scheduler.in_system),
+                      ('blocked', scheduler.blocked),
+                      ('io_queue', len(scheduler.io_device.queue)))
+            for key, depth in depths:
+                if depth > peaks[key]:
+                    peaks[key] = depth
+
+        scheduler.process_event = timed_process_event
+        scheduler.check_running_process = timed_check_running_process
+
+    def summary(self) -> dict:
+        """
+        Counters and timings as plain data
+        :return: dict of events by type with count, seconds and mean ns,
+            dispatch timing, peak depths and loop and offload seconds
+        """
+        events = {name: {'count': count,
+                         'seconds': self.handler_time[name],
+                         'mean_ns': self.handler_time[name] / count * 1e9}
+                  for name, count in sorted(self.counts.items())}
+        total = sum(self.counts.values())
+        return {'events': events,
+                'total_events': total,
+                'dispatch': {'count': self.dispatches,
+                             'seconds': self.dispatch_time,
+                             'mean_ns': self.dispatch_time / self.dispatches * 1e9
+                                        if self.dispatches else 0.0},
+                'peaks': dict(self.peaks),
+                'loop_seconds': self.loop_time,
+                'ns_per_event': self.loop_time / total * 1e9 if total else 0.0,
+                'offload_seconds': self.offload_time}
+
+    def write(self, path: Path):
+        """
+        Log the summary and write it as JSON
+        :param path: destination file
+        """
+        summary = self.summary()
+        logging.info('Event loop instrumentation: %s', json.dumps(summary, sort_keys=True))
+        with open(str(path), 'w') as file:
+            json.dump(summary, file, indent=2, sort_keys=True)
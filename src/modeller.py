@@ -1,21 +1,16 @@
 """Data Modelling class"""
-# pylint: disable=wrong-import-position,wrong-import-order
 import csv
 import logging
-from os import rename
 from pathlib import Path
-import pandas as pd
-import numpy as np
 from src.commons.commons import calc_high_level_stats
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from src.stats import OnlineStats
 
 
 class Modeller:
     """
-    Data modeller class.  Plots output of simulation runs
+    Data modeller class.  Lays out run directories and writes the stats of
+    simulation runs, plotting lives in src.plots so simulation workers
+    never import pandas or matplotlib.
     This doesn't really need to be class and could be factored out into
     pure functions
     Attributes:
@@ -24,6 +19,8 @@ class Modeller:
     ABS_PATH = 'data'
     DATA_PATH = 'raw_data'
     PLOT_PATH = 'plots'
+    WORKLOAD_PATH = 'workloads'
+    RESULTS_FILE = 'results.csv'
 
     def __init__(self, path: str = ABS_PATH):
         self.abs_path = path
@@ -38,137 +35,113 @@ class Modeller:
         """Get plot path given identifier"""
         return Path('{0}/{1}/{2}'.format(Modeller.ABS_PATH, identifier, Modeller.PLOT_PATH))
 
-    def write_stats(self, in_list: np.array, path: str, **kwargs) -> Path:
+    @staticmethod
+    def get_workload_path(identifier: str) -> Path:
+        """Get shared workload trace path given identifier"""
+        return Path('{0}/{1}/{2}'.format(Modeller.ABS_PATH, identifier, Modeller.WORKLOAD_PATH))
+
+    @staticmethod
+    def get_raw_path(identifier: str, tag: str, raw_format: str) -> Path:
+        """Get raw per-process output path given identifier, run tag and format"""
+        return Modeller.get_data_path(identifier) / '{0}.{1}'.format(tag, raw_format)
+
+    @staticmethod
+    def get_profile_path(identifier: str, tag: str, suffix: str) -> Path:
+        """Get the path of a run's profiling output given identifier, run tag and suffix"""
+        return Path('{0}/{1}/{2}.{3}'.format(Modeller.ABS_PATH, identifier, tag, suffix))
+
+    @staticmethod
+    def get_results_path(identifier: str) -> Path:
+        """Get the path of the results file gathering every run of a sweep"""
+        return Path('{0}/{1}/{2}'.format(Modeller.ABS_PATH, identifier, Modeller.RESULTS_FILE))
+
+    @staticmethod
+    def read_stats(path: Path) -> dict:
+        """
+        Read a run's high level statistics
+        :param path: Path to a high_{tag}.csv written by write_stats
+        :return: dict of column to value, as strings
+        """
+        with open(str(path), newline='') as high:
+            return next(csv.DictReader(high))
+
+    @staticmethod
+    def append_results(identifier: str, row: dict):
+        """
+        Append a run's high level statistics to its sweep's results file
+        :param identifier: Sim grouping tag (unix timestamps)
+        :param row: dict of high level stats, see read_stats
         """
-        Write raw process run statistics
+        path = Modeller.get_results_path(identifier)
+        new = not path.exists()
+        with open(str(path), 'a', newline='') as results:
+            writer = csv.DictWriter(results, fieldnames=list(row))
+            if new:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def write_stats(self, stats: OnlineStats, path: str, **kwargs) -> Path:
+        """
+        Write high level run statistics.  Raw per-process rows are streamed
+        separately by stats.RawSink while the simulation runs.
         TODO: In an ideal world there would not be so many magic strings here
-        :param in_list: list of processes to be written
+        :param stats: OnlineStats accumulated over the run
         :param path: str: tag name of run to be written
         :return: path to parent of data folder
         """
         timestamp = kwargs.get('created_at')
         members = (self.abs_path, timestamp, Modeller.DATA_PATH, path)
-        identifier = "{0}/{1}/{2}/{3}.csv".format(*members)
-        data_path = Path(identifier)
-        high_level_path = '{}/high_{}.csv'.format(self.get_data_path(timestamp), path)
-
-        with open(str(data_path), 'w', newline='') as file:
-            kwargs['turnaround_time'] = 0
-            kwargs['wait_time'] = 0
-            writer = csv.writer(file, delimiter=',')
-            # Write CSV Headers
-            writer.writerow((
-                'id',
-                'created_at',
-                'start_at',
-                'run_time',
-                'total_time',
-                'used',
-                'completed_at'
-            ))
-            # Write row for each process
-            for p in in_list:
-                kwargs['turnaround_time'] += p.total_time
-                kwargs['wait_time'] += p.total_time - p.used
-
-                csv_output = (
-                    p.id,
-                    p.created_at,
-                    p.start_at,
-                    p.run_time,
-                    p.total_time,
-                    p.used,
-                    p.completed_at
-                )
-                writer.writerow(csv_output)
-
-            row = calc_high_level_stats(**kwargs)
-            with open(high_level_path, 'w', newline='') as high:
-                writer = csv.writer(high)
-                writer.writerow(
-                    ('type',
-                     'lambda',
-                     'turnaround_time',
-                     'throughput',
-                     'utilization',
-                     'avg_process_count')
-                )
-                writer.writerow(row)
-
-        if not data_path.exists():
+        identifier = "{0}/{1}/{2}/high_{3}.csv".format(*members)
+        high_level_path = Path(identifier)
+
+        kwargs['turnaround_time'] = stats.turnaround_time()
+        kwargs['wait_time'] = stats.wait_time()
+
+        row = calc_high_level_stats(**kwargs) + stats.percentiles() + (
+            kwargs.get('avg_in_system'),
+            kwargs.get('littles_law_error')) + stats.steady_state() + (
+                stats.count,
+                kwargs.get('burst_lambda'),
+                kwargs.get('switches'),
+                kwargs.get('switch_time') / kwargs.get('total_time'),
+                kwargs.get('cores', 1),
+                kwargs.get('migrations', 0),
+                ' '.join('{:.6g}'.format(usage) for usage in kwargs.get('core_utilization', ())),
+                kwargs.get('io_utilization', 0.0),
+                kwargs.get('avg_blocked', 0.0),
+                kwargs.get('cpu_io_overlap', 0.0))
+        with open(str(high_level_path), 'w', newline='') as high:
+            writer = csv.writer(high)
+            writer.writerow(
+                ('type',
+                 'lambda',
+                 'turnaround_time',
+                 'throughput',
+                 'utilization',
+                 'avg_process_count',
+                 'turnaround_p50',
+                 'turnaround_p95',
+                 'turnaround_p99',
+                 'avg_in_system',
+                 'littles_law_error',
+                 'turnaround_steady',
+                 'turnaround_ci',
+                 'processes',
+                 'burst',
+                 'context_switches',
+                 'switch_overhead',
+                 'cores',
+                 'migrations',
+                 'core_utilization',
+                 'io_utilization',
+                 'avg_blocked',
+                 'cpu_io_overlap')
+            )
+            writer.writerow(row)
+
+        if not high_level_path.exists():
             message = 'Bad stats path: {}'.format(str(identifier))
             logging.critical(message)
             raise Exception(message)
 
-        return Path(high_level_path).parent
-
-    @staticmethod
-    def plot(files: [Path]):
-        """
-        This is a mess, but read through all the high level stats csvs,
-        then sort the resultant dataframe by schedule type and lambda value
-        plot throughput, turnaround time, utilization, mean.
-        Plot this and save to a file.
-        :param files: A list of Paths to high level stats to be plotted
-        """
-        # Read data
-        data = pd.concat((pd.read_csv(str(file)) for file in files))
-        data = data.sort_values(['type', 'lambda'])
-
-        # Create plots
-        fig, axes = plt.subplots(nrows=2, ncols=2, figsize=(12.8, 9.6))
-        turnaround, throughput, utilization, mean = axes.flatten()
-
-        # Plot data by type and given statistics
-        for key, group in data.groupby(['type']):
-            turnaround = group.plot(ax=turnaround,
-                                    marker='o',
-                                    x='lambda',
-                                    y='turnaround_time',
-                                    label=key)
-            throughput = group.plot(ax=throughput,
-                                    marker='o',
-                                    x='lambda',
-                                    y='throughput',
-                                    label=key)
-            utilization = group.plot(ax=utilization,
-                                     marker='o',
-                                     x='lambda',
-                                     y='utilization',
-                                     label=key)
-            mean = group.plot(ax=mean,
-                              marker='o',
-                              x='lambda',
-                              y='avg_process_count',
-                              label=key)
-
-        # Format and label individual plots
-        turnaround.set_title('Turnaround time')
-        throughput.set_title('Throughput')
-        utilization.set_title('Utilization')
-        mean.set_title('Avg processes in queue')
-
-        throughput.set_ylabel('$processes/second$')
-        turnaround.set_ylabel('$seconds$')
-        utilization.set_ylabel('$value$')
-        mean.set_ylabel('$processes$')
-
-        throughput.yaxis.set_label_position('right')
-        mean.yaxis.set_label_position('right')
-        throughput.yaxis.tick_right()
-        mean.yaxis.tick_right()
-
-        # Final formatting for all plots
-        for ax in fig.axes:
-            ax.set_xlim(0, 30)
-            ax.set_xlabel('$lambda$')
-            ax.tick_params(axis='x', which='minor')
-            ax.grid(True)
-            ax.xaxis.grid(True, which='minor')
-
-        # Save figure and move into data/{tag}/plots/plot.png
-        fig.tight_layout()
-        plt.savefig('ax')
-        members = (files[0].parent.parent, Modeller.PLOT_PATH)
-        identifier = "{0}/{1}/plot.png".format(*members)
-        rename('ax.png', identifier)
+        return high_level_path.parent
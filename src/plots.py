@@ -0,0 +1,222 @@
+"""
+Plots of simulation results.  Kept apart from the simulation path so
+workers running simulations never pay for importing pandas and matplotlib.
+
+Figures are drawn from results already gathered in memory, or read from a
+sweep's single results file, and every file is written to a unique
+temporary name in the plots directory then renamed into place, so readers
+and concurrent sweeps never see a half written figure.
+"""
+import csv
+import io
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# (column, title, y label) of every metric given its own figure
+METRICS = (
+    ('turnaround_time', 'Turnaround time', '$seconds$'),
+    ('throughput', 'Throughput', '$processes/second$'),
+    ('utilization', 'Utilization', '$value$'),
+    ('avg_process_count', 'Avg processes in queue', '$processes$'),
+    ('turnaround_p95', 'Turnaround time p95', '$seconds$'),
+    ('avg_in_system', 'Avg processes in system', '$processes$'),
+    ('switch_overhead', 'Context switch overhead', '$value$'),
+    ('io_utilization', 'I/O utilization', '$value$'),
+    ('avg_blocked', 'Avg processes blocked', '$processes$'),
+)
+# Metrics of the 2x2 summary figure
+SUMMARY = ('turnaround_time', 'throughput', 'utilization', 'avg_process_count')
+# Lambda ranges spanning more than this ratio are plotted on a log axis
+LOG_RATIO = 100
+
+
+def load_results(path: Path) -> pd.DataFrame:
+    """
+    Read a sweep's results file
+    :param path: results csv, see Modeller.get_results_path
+    :return: DataFrame with one row per run
+    """
+    return pd.read_csv(str(path))
+
+
+def results_frame(rows: list) -> pd.DataFrame:
+    """
+    Build a DataFrame from high level stats rows as read by csv, typed
+    exactly as load_results would read them from the results file
+    :param rows: list of dicts of column to string value
+    :return: DataFrame with one row per run
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+
+def groups(data: pd.DataFrame) -> list:
+    """
+    Split results into one line per scheduler.  Sweeps over several burst
+    times or core counts get one line per combination.
+    :param data: results DataFrame
+    :return: list of (label, DataFrame sorted by lambda)
+    """
+    keys = ['type']
+    for column in ('burst', 'cores'):
+        if column in data and data[column].nunique() > 1:
+            keys.append(column)
+
+    lines = []
+    for key, group in data.groupby(keys):
+        label = ' '.join('{} {}'.format(column, part) if column != 'type' else str(part)
+                         for column, part in zip(keys, key))
+        lines.append((label, group.sort_values('lambda')))
+    return lines
+
+
+def plot_metric(ax, lines: list, column: str, title: str, ylabel: str):
+    """
+    Draw one metric against lambda for every line
+    :param ax: matplotlib Axes to draw on
+    :param lines: list of (label, DataFrame) from groups
+    :param column: results column to plot
+    :param title: axes title
+    :param ylabel: y axis label
+    """
+    kwargs = {'y': column}
+    # Steady-state runs report batch means with confidence intervals
+    if column == 'turnaround_time' and all(
+            'turnaround_ci' in group and group['turnaround_ci'].notna().any()
+            for _, group in lines):
+        kwargs = {'y': 'turnaround_steady', 'yerr': 'turnaround_ci', 'capsize': 3}
+
+    for label, group in lines:
+        group.plot(ax=ax, marker='o', x='lambda', label=label, **kwargs)
+
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel('$lambda$')
+    scale_lambda(ax, pd.concat(group['lambda'] for _, group in lines))
+    ax.grid(True)
+    ax.xaxis.grid(True, which='minor')
+
+
+def scale_lambda(ax, rates: pd.Series):
+    """
+    Fit the x axis to the swept arrival rates, on a log scale for rates
+    spanning orders of magnitude
+    :param ax: matplotlib Axes
+    :param rates: lambda of every plotted point
+    """
+    low, high = rates.min(), rates.max()
+    if low > 0 and high / low >= LOG_RATIO:
+        ax.set_xscale('log')
+        ax.set_xlim(low / 1.2, high * 1.2)
+    elif high > low:
+        margin = (high - low) * 0.05
+        ax.set_xlim(low - margin, high + margin)
+
+
+def save_figure(fig: Figure, path: Path, formats: list):
+    """
+    Atomically write a figure in several formats
+    :param fig: Figure to save
+    :param path: destination without extension, e.g. plots/plot
+    :param formats: file formats such as png and svg
+    """
+    canvas = FigureCanvasAgg(fig)
+    for fmt in formats:
+        handle, temp = tempfile.mkstemp(prefix='.{}.'.format(path.name),
+                                        suffix='.{}'.format(fmt),
+                                        dir=str(path.parent))
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                canvas.print_figure(file, format=fmt)
+            os.replace(temp, '{0}.{1}'.format(path, fmt))
+        except BaseException:
+            os.remove(temp)
+            raise
+
+
+def plot(data: pd.DataFrame,
+         plot_path: Path,
+         formats=('png', 'svg'),
+         per_metric: bool = True) -> list:
+    """
+    Plot a sweep's results: a summary figure of turnaround time, throughput,
+    utilization and queue length, and one figure per metric that varies
+    across runs
+    :param data: results DataFrame, see load_results and results_frame
+    :param plot_path: directory the figures are written to
+    :param formats: file formats to write
+    :param per_metric: also draw the per metric figures
+    :return: list of Paths of the summary figure in each format
+    """
+    lines = groups(data)
+    metrics = {column: (title, ylabel) for column, title, ylabel in METRICS}
+
+    fig = Figure(figsize=(12.8, 9.6))
+    axes = fig.subplots(nrows=2, ncols=2).flatten()
+    for ax, column in zip(axes, SUMMARY):
+        plot_metric(ax, lines, column, *metrics[column])
+    # Right hand plots keep their labels out of the way of the left ones
+    for ax in axes[1::2]:
+        ax.yaxis.set_label_position('right')
+        ax.yaxis.tick_right()
+    fig.tight_layout()
+    save_figure(fig, plot_path / 'plot', formats)
+
+    for column, title, ylabel in METRICS if per_metric else ():
+        # Nothing to compare when the metric never varies, e.g. I/O metrics without I/O
+        if column not in data or data[column].nunique() <= 1:
+            continue
+        fig = Figure(figsize=(6.4, 4.8))
+        plot_metric(fig.subplots(), lines, column, title, ylabel)
+        fig.tight_layout()
+        save_figure(fig, plot_path / column, formats)
+
+    return [plot_path / 'plot.{}'.format(fmt) for fmt in formats]
+
+
+class IncrementalPlotter:
+    """
+    Gathers results as sweep cells complete and redraws the plots every few
+    results, so a long sweep can be watched as it runs.  Redraws during
+    the sweep only update the summary figure, the per metric figures are
+    drawn once at the end.
+
+    Attributes:
+        plot_path: directory the figures are written to
+        formats: file formats to write
+        every: redraw after this many new results, 0 to draw only on finish
+        rows: high level stats rows gathered so far
+    """
+    def __init__(self, plot_path: Path, formats=('png', 'svg'), every: int = 0):
+        self.plot_path = plot_path
+        self.formats = formats
+        self.every = every
+        self.rows = []
+
+    def add(self, row: dict):
+        """
+        Add a finished run's results, redrawing if enough have arrived
+        :param row: dict of high level stats, see Modeller.read_stats
+        """
+        self.rows.append(row)
+        if self.every and len(self.rows) % self.every == 0:
+            self.draw(per_metric=False)
+
+    def draw(self, per_metric: bool = True) -> list:
+        """
+        Redraw the figures from the results gathered so far
+        :param per_metric: also draw the per metric figures
+        :return: list of Paths of the summary figure, empty if there are no results
+        """
+        if not self.rows:
+            return []
+        return plot(results_frame(self.rows), self.plot_path, self.formats, per_metric)
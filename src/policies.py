@@ -0,0 +1,408 @@
+"""Scheduling policies and the registry the Scheduler looks them up in"""
+import heapq
+import importlib
+import logging
+import math
+
+from src.commons.commons import SCHEDULE_TYPES, EVENT_TYPES
+from src.queues import PriorityProcessQueue, FifoProcessQueue, ResponseRatioQueue, \
+    MultilevelQueue
+
+POLICIES = {}
+POLICY_NAMES = {}
+
+
+def register_policy(policy):
+    """
+    Class decorator adding a Policy to the registry under its type and name.
+    Policies registered in a module imported before the sweep starts are
+    inherited by the worker processes.
+    :param policy: Policy subclass with a unique type and name
+    :return: the policy, unchanged
+    """
+    if policy.type in POLICIES and POLICIES[policy.type] is not policy:
+        message = 'Schedule type {} already registered to {}'.format(
+            policy.type, POLICIES[policy.type].__name__)
+        logging.critical(message)
+        raise Exception(message)
+    POLICIES[policy.type] = policy
+    POLICY_NAMES[policy.name] = policy.type
+    return policy
+
+
+def get_policy(method):
+    """
+    Look up a registered policy
+    :param method: schedule type number or registered name, e.g. 3 or 'RR'
+    :return: Policy subclass
+    """
+    if isinstance(method, str):
+        method = POLICY_NAMES.get(method.upper(), method)
+    try:
+        return POLICIES[method]
+    except KeyError:
+        message = "Unknown schedule type: {}".format(method)
+        logging.critical(message)
+        raise Exception(message)
+
+
+def load_plugins(modules):
+    """
+    Import modules registering extra policies.  Called in the sweep's parent
+    and again in every pool worker, which may be spawned rather than forked
+    and so start with only the built in policies.
+    :param modules: iterable of dotted module names
+    """
+    for module in modules:
+        importlib.import_module(module)
+
+
+class Policy:
+    """
+    Base scheduling policy.
+
+    A policy owns a ready queue and the cores it feeds: every core with a
+    global run queue, or a single core with per-core queues.  The Scheduler
+    calls these hooks directly, so the event loop never branches on the
+    schedule type.  Subclasses choose a ready queue and override the hooks
+    they need, then register with register_policy.
+
+    Attributes:
+        type: unique schedule type number, stored in the stats
+        name: registry name used on the command line and in sweep specs
+        title: human readable name used in plots
+        takes_quantum: True if the policy uses the quantum config
+        scheduler: Scheduler the policy drives
+        cores: list of the Cores this policy dispatches to
+        idle: heap of (free_since, index) of this policy's idle cores
+        options: dict of policy specific options from the Simulator config
+        queue: ready queue of processes
+    """
+    type = None
+    name = None
+    title = None
+    takes_quantum = False
+
+    def __init__(self, scheduler, cores: list):
+        self.scheduler = scheduler
+        self.cores = cores
+        self.idle = [(0.0, core.index) for core in cores]
+        for core in cores:
+            core.policy = self
+        self.options = scheduler.config.get('options') or {}
+        self.queue = self.make_queue()
+
+    @classmethod
+    def label(cls, quantum: float = None) -> str:
+        """Human readable label, with the quantum for policies that take one"""
+        if cls.takes_quantum:
+            return '{0} {1:g}'.format(cls.title, quantum)
+        return cls.title
+
+    def make_queue(self):
+        """Build the ready queue, lowest key first by default"""
+        return PriorityProcessQueue()
+
+    def key(self, process) -> float:
+        """Ready queue priority of a process, lowest runs first"""
+        return process.created_at
+
+    def put(self, process):
+        """
+        Insert a process into the ready queue
+        :param process: Process to be inserted
+        """
+        self.queue.put(process, self.key(process))
+
+    def pop(self):
+        """Remove and return the process to run next"""
+        return self.queue.get()
+
+    def start(self):
+        """
+        Dispatch the next process on the longest idle core
+        :return: the Core it now runs on
+        """
+        _, index = heapq.heappop(self.idle)
+        core = self.scheduler.cores[index]
+        self.scheduler.dispatch(core, self.pop())
+        return core
+
+    def peek_running(self, heap: list):
+        """
+        Top of a heap of (priority, generation, core index) entries pushed at
+        dispatch, dropping entries whose process has since left its core
+        :param heap: heap maintained by the policy
+        :return: Core of the top entry, None if no entry is live
+        """
+        cores = self.scheduler.cores
+        while heap:
+            _, generation, index = heap[0]
+            core = cores[index]
+            if core.generation == generation:
+                return core
+            heapq.heappop(heap)
+        return None
+
+    def on_arrival(self, process):
+        """
+        A new process has arrived
+        :param process: the new Process
+        """
+        logging.debug("%s: Inserting process: %s", self.scheduler.current_time, process)
+        self.put(process)
+
+    def on_complete(self, process):
+        """
+        The running process finished, it has already been recorded
+        :param process: the completed Process
+        """
+
+    def on_quantum(self, process):
+        """
+        The running process used up its quantum and was switched out
+        :param process: the preempted Process
+        """
+        self.put(process)
+
+    def on_migrate(self, process, source):
+        """
+        A process moved here from another core's policy, stolen from its
+        queue or woken from I/O while its own core was busy
+        :param process: the moved Process
+        :param source: Policy it was taken from
+        """
+        self.put(process)
+
+    def on_wake(self, process):
+        """
+        A blocked process finished its I/O and is ready for its next CPU burst
+        :param process: the woken Process
+        """
+        self.put(process)
+
+    def pick_next(self):
+        """
+        Called after every event.  Start queued processes on idle cores and
+        arm the timers that will stop them.
+        """
+        while self.idle and self.queue:
+            core = self.start()
+            self.scheduler.arm_timer(core, core.running.get_remaining(), EVENT_TYPES['COMPLETE'])
+
+
+@register_policy
+class FirstComeFirstServed(Policy):
+    """
+    Run processes to completion in arrival order.
+    Arrivals are popped in time order and never requeued, so a plain FIFO
+    is already sorted by created_at.
+    """
+    type = SCHEDULE_TYPES['FCFS']
+    name = 'FCFS'
+    title = 'First Come First Served'
+
+    def make_queue(self):
+        return FifoProcessQueue()
+
+
+@register_policy
+class ShortestJobFirst(Policy):
+    """Run the shortest queued process to completion"""
+    type = SCHEDULE_TYPES['SJF']
+    name = 'SJF'
+    title = 'Shortest Job First'
+
+    def key(self, process) -> float:
+        # The next CPU burst, the whole run time for single burst processes
+        return process.get_remaining()
+
+
+@register_policy
+class ShortestRemainingTimeFirst(Policy):
+    """Run the process with the least remaining time, preempting on arrival"""
+    type = SCHEDULE_TYPES['SRTF']
+    name = 'SRTF'
+    title = 'Shortest Remaining Time First'
+
+    def __init__(self, scheduler, cores: list):
+        super().__init__(scheduler, cores)
+        # Running processes by latest finish, the most remaining time on top
+        self.finishing = []
+
+    def key(self, process) -> float:
+        return process.get_remaining()
+
+    def pick_next(self):
+        scheduler = self.scheduler
+        while self.queue:
+            if not self.idle:
+                # Do we need to preempt a process?
+                core = self.peek_running(self.finishing)
+                if core is None or not self.queue.peek_key() < scheduler.remaining(core):
+                    return
+                logging.debug("%s: offloading process: %s", scheduler.current_time, core.running)
+                self.put(scheduler.release(core))
+
+            core = self.start()
+            remaining = core.running.get_remaining()
+            scheduler.arm_timer(core, remaining, EVENT_TYPES['COMPLETE'])
+            heapq.heappush(self.finishing,
+                           (-(core.work_from + remaining), core.generation, core.index))
+
+
+@register_policy
+class HighestResponseRatioNext(Policy):
+    """
+    Run the process with the highest (wait + service) / service to completion
+    Options:
+        growth: ratio of service times between ready queue buckets
+    """
+    type = SCHEDULE_TYPES['HRRN']
+    name = 'HRRN'
+    title = 'Highest Response Ratio Next'
+
+    def make_queue(self):
+        return ResponseRatioQueue(self.options.get('growth', ResponseRatioQueue.GROWTH))
+
+    def put(self, process):
+        self.queue.put(process, process.get_remaining())
+
+    def pop(self):
+        return self.queue.get(self.scheduler.current_time)
+
+
+@register_policy
+class RoundRobin(Policy):
+    """Run processes in arrival order for at most one quantum at a time"""
+    type = SCHEDULE_TYPES['RR']
+    name = 'RR'
+    title = 'Round Robin'
+    takes_quantum = True
+
+    def __init__(self, scheduler, cores: list):
+        super().__init__(scheduler, cores)
+        self.quantum = scheduler.config['quantum']
+
+    def make_queue(self):
+        return FifoProcessQueue()
+
+    def put(self, process):
+        self.queue.put(process)
+
+    def pick_next(self):
+        scheduler = self.scheduler
+        while self.idle and self.queue:
+            core = self.start()
+            remain = core.running.get_remaining()
+            if remain < self.quantum:
+                logging.debug('scheduling RR completion: %s', core.running)
+                scheduler.arm_timer(core, remain, EVENT_TYPES['COMPLETE'])
+            else:
+                scheduler.arm_timer(core, self.quantum, EVENT_TYPES['SWITCH'])
+
+
+@register_policy
+class MultilevelFeedbackQueue(Policy):
+    """
+    Multilevel feedback queue.  New processes start at level 0, a process
+    that uses its whole quantum drops a level, and a process at a higher
+    level preempts one running at a lower level.  Every boost interval all
+    processes return to level 0.
+    Options:
+        levels: number of levels
+        quanta: quantum of each level, defaults to the quantum doubling per level
+        boost: seconds between priority boosts, None to never boost
+    """
+    type = SCHEDULE_TYPES['MLFQ']
+    name = 'MLFQ'
+    title = 'MLFQ'
+    takes_quantum = True
+
+    def __init__(self, scheduler, cores: list):
+        super().__init__(scheduler, cores)
+        self.quanta = self.options.get('quanta')
+        if not self.quanta:
+            quantum = scheduler.config['quantum']
+            self.quanta = [quantum * 2 ** level for level in range(self.queue_levels())]
+        self.boost = self.options.get('boost', 1.0)
+        self.next_boost = self.boost if self.boost else math.inf
+        # Level of each live process as (level, epoch), epochs before the
+        # latest boost mean level 0 so boosting never touches this dict
+        self.levels = {}
+        self.epoch = 0
+        # Running processes by level, the lowest priority on top
+        self.running_levels = []
+
+    def queue_levels(self) -> int:
+        """Number of levels, from the quanta option if given"""
+        quanta = self.options.get('quanta')
+        return len(quanta) if quanta else self.options.get('levels', 3)
+
+    def make_queue(self):
+        return MultilevelQueue(self.queue_levels())
+
+    def label(self, quantum: float = None) -> str:
+        """Human readable label with the top level quantum, which the quanta option may set"""
+        return super().label(self.quanta[0])
+
+    def level(self, process) -> int:
+        """Current level of a process"""
+        level, epoch = self.levels[process.id]
+        return level if epoch == self.epoch else 0
+
+    def put(self, process):
+        self.queue.put(process, self.level(process))
+
+    def on_arrival(self, process):
+        self.levels[process.id] = (0, self.epoch)
+        super().on_arrival(process)
+
+    def on_complete(self, process):
+        del self.levels[process.id]
+
+    def on_quantum(self, process):
+        level = min(self.level(process) + 1, len(self.quanta) - 1)
+        self.levels[process.id] = (level, self.epoch)
+        self.queue.put(process, level)
+
+    def on_migrate(self, process, source):
+        level = source.level(process)
+        del source.levels[process.id]
+        self.levels[process.id] = (level, self.epoch)
+        self.queue.put(process, level)
+
+    def _boost(self, now: float):
+        """Return every process to level 0, checked lazily on the next event"""
+        self.queue.boost()
+        self.epoch += 1
+        # Every running process is now at level 0 and cannot be preempted
+        self.running_levels = []
+        self.next_boost = (math.floor(now / self.boost) + 1) * self.boost
+        logging.debug('%s: MLFQ priority boost', now)
+
+    def pick_next(self):
+        scheduler = self.scheduler
+        if scheduler.current_time >= self.next_boost:
+            self._boost(scheduler.current_time)
+
+        while self.queue:
+            top = self.queue.top()
+            if not self.idle:
+                core = self.peek_running(self.running_levels)
+                if core is None:
+                    return
+                level = self.level(core.running)
+                if top >= level:
+                    return
+                logging.debug("%s: offloading process: %s", scheduler.current_time, core.running)
+                self.queue.put_front(scheduler.release(core), level)
+
+            core = self.start()
+            remain = core.running.get_remaining()
+            quantum = self.quanta[top]
+            if remain < quantum:
+                scheduler.arm_timer(core, remain, EVENT_TYPES['COMPLETE'])
+            else:
+                scheduler.arm_timer(core, quantum, EVENT_TYPES['SWITCH'])
+            heapq.heappush(self.running_levels, (-top, core.generation, core.index))
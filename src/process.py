@@ -1,5 +1,5 @@
 """Process"""
-from arrow import Arrow
+from src.commons.commons import PROCESS_STATES
 
 
 class Process:
@@ -7,17 +7,31 @@ class Process:
     An individual Process
     Attributes:
         process_id: ID of process - uniqueness must be maintained by user
-        created_at: the Arrow datetime this process entered the ready queue
-        start_at: the Arrow datetime the process entered the CPU
-        run_time: in seconds
+        created_at: simulation time (sec) this process entered the ready queue
+        start_at: simulation time (sec) the process entered the CPU
+        run_time: total CPU time in seconds, over every CPU burst
         total_time: total time taken to execute, inclusive of non run time
         used: total time that has been partially worked on this process
-        completed_at: Arrow datetime this process was completed at
+        completed_at: simulation time (sec) this process was completed at
+        core: index of the core the process last ran on, None before it first runs
+        bursts: alternating CPU and I/O burst times [cpu, io, cpu, ..., cpu] in
+            seconds, None for a single CPU burst of run_time
+        burst_index: index in bursts of the current CPU burst
+        burst_end: CPU time used by the end of the current CPU burst
+        state: one of commons.PROCESS_STATES
+        ready_at: simulation time the process last became ready, its creation
+            or the end of its last I/O burst
     """
+    # No per-instance __dict__, keeps millions of live processes compact
+    __slots__ = ('id', 'created_at', 'start_at', 'run_time', 'total_time', 'used', 'completed_at',
+                 'core', 'bursts', 'burst_index', 'burst_end', 'state',
+                 'ready_at')
+
     def __init__(self,
                  run_time: float,
                  process_id: int,
-                 created_at: Arrow):
+                 created_at: float,
+                 bursts: list = None):
         self.id = process_id
         self.created_at = created_at
         self.start_at = None
@@ -25,16 +39,25 @@ class Process:
         self.total_time = 0
         self.used = 0
         self.completed_at = None
+        self.core = None
+        self.bursts = bursts
+        self.burst_index = 0
+        self.burst_end = bursts[0] if bursts else run_time
+        self.state = PROCESS_STATES['READY']
+        self.ready_at = created_at
 
     def __lt__(self, other) -> bool:
-        """Implement comparable for Priority Queueing"""
-        priority = (self.created_at,
-                    self.run_time - self.used,
-                    self.run_time)
-        other_priority = (other.created_at,
-                          other.run_time - other.used,
-                          other.run_time)
-        return priority < other_priority
+        """
+        Implement comparable for Priority Queueing.
+        Orders by (created_at, remaining time, run_time) without building tuples.
+        """
+        if self.created_at != other.created_at:
+            return self.created_at < other.created_at
+        remaining = self.run_time - self.used
+        other_remaining = other.run_time - other.used
+        if remaining != other_remaining:
+            return remaining < other_remaining
+        return self.run_time < other.run_time
 
     def __repr__(self):
         """JSON output for log file"""
@@ -43,27 +66,39 @@ class Process:
                str(self.run_time) + '","total_time":"' + str(self.total_time) + \
                '","used":"' + str(self.used) + '","completed_at":"' + str(self.completed_at) + '"}'
 
-    def set_completed(self, completed_at: Arrow) -> float:
+    def set_completed(self, completed_at: float) -> float:
         """
         Set process as completed
-        :param completed_at: datetime of completion
+        :param completed_at: simulation time of completion
         :return: total_time: seconds
         """
         self.completed_at = completed_at
-        self.total_time = (self.completed_at - self.created_at).total_seconds()
+        self.total_time = self.completed_at - self.created_at
         return self.total_time
 
-    def set_used(self, start: Arrow, end: Arrow) -> float:
+    def set_used(self, start: float, end: float) -> float:
         """
         Set partial amount of time used
-        :param start: Arrow object representing work start time
-        :param end: Arrow object representing work end time
+        :param start: simulation time representing work start
+        :param end: simulation time representing work end
         :return: float time remaining in sec
         """
-        elapsed = (end - start).total_seconds()
+        elapsed = end - start
         self.used += elapsed
         return self.total_time - self.used
 
     def get_remaining(self) -> float:
-        """Get remaining run time"""
-        return self.run_time - self.used
+        """Get remaining run time of the current CPU burst"""
+        return self.burst_end - self.used
+
+    def next_burst(self) -> float:
+        """
+        Move on to the next CPU burst once the current one is done
+        :return: seconds of I/O before the next CPU burst, None if this was the last
+        """
+        index = self.burst_index + 2
+        if self.bursts is None or index >= len(self.bursts):
+            return None
+        self.burst_index = index
+        self.burst_end += self.bursts[index]
+        return self.bursts[index - 1]
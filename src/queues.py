@@ -0,0 +1,283 @@
+"""Single-threaded event and ready queues"""
+import heapq
+import math
+from collections import deque
+from itertools import count
+
+
+class EventQueue:
+    """
+    Min-heap of events ordered by created_at.
+
+    Each simulation runs in its own process so there is no need for the
+    locking done by queue.PriorityQueue.  Ties on created_at are broken by
+    insertion order so runs are deterministic.
+
+    Attributes:
+        heap: list of (created_at, sequence, event) entries
+    """
+    def __init__(self):
+        self.heap = []
+        self._counter = count()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __iter__(self):
+        """Iterate over the queued events in no particular order"""
+        return (entry[2] for entry in self.heap)
+
+    def empty(self) -> bool:
+        """True if there are no queued events"""
+        return not self.heap
+
+    def put(self, event):
+        """
+        Push an event onto the queue
+        :param event: Event to be queued
+        """
+        heapq.heappush(self.heap, (event.created_at, next(self._counter), event))
+
+    def put_many(self, events):
+        """
+        Push many events at once
+        :param events: iterable of Events to be queued
+        """
+        self.heap.extend((event.created_at, next(self._counter), event) for event in events)
+        heapq.heapify(self.heap)
+
+    def get(self):
+        """Pop the earliest event"""
+        return heapq.heappop(self.heap)[2]
+
+    def peek(self):
+        """Return the earliest event without removing it"""
+        return self.heap[0][2]
+
+
+class PriorityProcessQueue:
+    """
+    Min-heap of processes ordered by a caller supplied key.
+    Ties are broken by insertion order.
+
+    Attributes:
+        heap: list of (key, sequence, process) entries
+    """
+    def __init__(self):
+        self.heap = []
+        self._counter = count()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def empty(self) -> bool:
+        """True if there are no queued processes"""
+        return not self.heap
+
+    def put(self, process, key: float):
+        """
+        Insert a process
+        :param process: Process to be inserted
+        :param key: priority, lowest first
+        """
+        heapq.heappush(self.heap, (key, next(self._counter), process))
+
+    def get(self):
+        """Pop the process with the lowest key"""
+        return heapq.heappop(self.heap)[2]
+
+    def peek(self):
+        """Return the process with the lowest key without removing it"""
+        return self.heap[0][2]
+
+    def peek_key(self) -> float:
+        """Return the lowest key"""
+        return self.heap[0][0]
+
+
+class FifoProcessQueue:
+    """
+    First in first out queue of processes backed by a deque
+
+    Attributes:
+        items: deque of queued processes
+    """
+    def __init__(self):
+        self.items = deque()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def empty(self) -> bool:
+        """True if there are no queued processes"""
+        return not self.items
+
+    def put(self, process, key: float = None):
+        """
+        Append a process, key is accepted for interface parity and ignored
+        :param process: Process to be inserted
+        :param key: unused
+        """
+        self.items.append(process)
+
+    def get(self):
+        """Pop the oldest process"""
+        return self.items.popleft()
+
+    def peek(self):
+        """Return the oldest process without removing it"""
+        return self.items[0]
+
+
+class ResponseRatioQueue:
+    """
+    Ready queue popping the process with the highest response ratio
+    (wait + service) / service at a given time.
+
+    Ratios change as time passes so no fixed heap order exists.  Processes
+    are instead bucketed by service time into geometric buckets, each kept
+    in order of non-decreasing ready time.  A bucket's head has its longest wait,
+    so every other member's ratio is bounded by its own wait over the
+    bucket's smallest service time.  Heads are compared first, and a bucket
+    is only scanned past its head while that bound can still beat the best
+    ratio.
+
+    A pop therefore visits every bucket head plus the members whose ratio
+    is within a factor of growth of the best, still linear in the queue
+    length.  A finer growth scans fewer members at the price of more
+    buckets: with exponential service times and a queue of 10000, growth 2
+    visits about 4% of the queue per pop and 1.25 about 1.3%.
+
+    Attributes:
+        buckets: dict of bucket index to deque of (ready time, service, process)
+        growth: ratio of service times between adjacent buckets
+    """
+    # Smallest service time bucketed, guards log(0)
+    MIN_SERVICE = 1e-12
+    # Default ratio between buckets, the fastest for deep queues
+    GROWTH = 1.25
+
+    def __init__(self, growth: float = GROWTH):
+        self.buckets = {}
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def empty(self) -> bool:
+        """True if there are no queued processes"""
+        return not self._count
+
+    def put(self, process, key: float, ready_at: float = None):
+        """
+        Insert a process.  Processes put in order of ready time are appended,
+        an older one, e.g. stolen from another core, is inserted in order.
+        :param process: Process to be inserted
+        :param key: service time of the process
+        :param ready_at: time the process started waiting, defaults to process.ready_at
+        """
+        service = max(key, ResponseRatioQueue.MIN_SERVICE)
+        index = math.floor(math.log(service) / self._log_growth)
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = deque()
+        if ready_at is None:
+            ready_at = process.ready_at
+        entry = (ready_at, service, process)
+        if bucket and bucket[-1][0] > ready_at:
+            pos = len(bucket) - 1
+            while pos and bucket[pos - 1][0] > ready_at:
+                pos -= 1
+            bucket.insert(pos, entry)
+        else:
+            bucket.append(entry)
+        self._count += 1
+
+    def get(self, now: float):
+        """
+        Pop the process with the highest response ratio, ties to the oldest bucket head
+        :param now: current simulation time
+        """
+        best_ratio, best_index, best_pos = -1.0, None, 0
+        for index, bucket in self.buckets.items():
+            arrival, service, _ = bucket[0]
+            ratio = (now - arrival) / service
+            if ratio > best_ratio:
+                best_ratio, best_index = ratio, index
+
+        for index, bucket in self.buckets.items():
+            # Slightly under the bucket's lower edge to absorb rounding in put
+            lowest = self.growth ** index * (1 - 1e-9)
+            for pos in range(1, len(bucket)):
+                arrival, service, _ = bucket[pos]
+                if (now - arrival) / lowest <= best_ratio:
+                    break
+                ratio = (now - arrival) / service
+                if ratio > best_ratio:
+                    best_ratio, best_index, best_pos = ratio, index, pos
+
+        bucket = self.buckets[best_index]
+        process = bucket[best_pos][2]
+        del bucket[best_pos]
+        if not bucket:
+            del self.buckets[best_index]
+        self._count -= 1
+        return process
+
+
+class MultilevelQueue:
+    """
+    Ready queue of FIFO levels, level 0 being the highest priority
+
+    Attributes:
+        levels: list of deques of queued processes
+    """
+    def __init__(self, levels: int):
+        self.levels = [deque() for _ in range(levels)]
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def empty(self) -> bool:
+        """True if there are no queued processes"""
+        return not self._count
+
+    def put(self, process, key: int = 0):
+        """
+        Append a process to a level
+        :param process: Process to be inserted
+        :param key: level to queue at
+        """
+        self.levels[key].append(process)
+        self._count += 1
+
+    def put_front(self, process, key: int = 0):
+        """
+        Return a preempted process to the front of its level
+        :param process: Process to be inserted
+        :param key: level to queue at
+        """
+        self.levels[key].appendleft(process)
+        self._count += 1
+
+    def top(self) -> int:
+        """Highest priority non-empty level, None if the queue is empty"""
+        for level, queue in enumerate(self.levels):
+            if queue:
+                return level
+        return None
+
+    def get(self):
+        """Pop the oldest process of the highest priority non-empty level"""
+        self._count -= 1
+        return self.levels[self.top()].popleft()
+
+    def boost(self):
+        """Move every queued process to level 0, keeping level then FIFO order"""
+        top = self.levels[0]
+        for queue in self.levels[1:]:
+            top.extend(queue)
+            queue.clear()
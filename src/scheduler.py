@@ -1,138 +1,297 @@
-"""Scheduler with baked in algorithm"""
+"""Event handling shared by every scheduling policy"""
+import heapq
 import logging
-from queue import PriorityQueue, Queue
-
-from arrow import Arrow
+from collections import deque
 
 from src.event import Event
 from src.process import Process
-from src.commons.commons import SCHEDULE_TYPES, EVENT_TYPES, rand_exp_float
+from src.queues import EventQueue
+from src.commons.commons import EVENT_TYPES, PROCESS_STATES
+from src.policies import get_policy
+from src.stats import OnlineStats
+from src.workload import Workload
+
+
+class Core:
+    """
+    One CPU of the simulated system.
+
+    Work done by the running process is charged lazily when it leaves the
+    core, so nothing is updated per core while events go by.
+
+    Attributes:
+        index: position of the core in Scheduler.cores
+        policy: Policy whose ready queue feeds this core
+        running: process on the core, None while idle
+        generation: timer generation, bumped to invalidate the core's pending
+            COMPLETE/SWITCH events
+        dispatched_at: simulation time the running process was dispatched
+        work_from: simulation time the running process starts making progress,
+            after any context switch
+        free_since: simulation time the core last went idle
+        last_process: process that last ran on the core
+        busy: total seconds the core was busy, switching included
+        switch_time: total seconds the core spent switching
+    """
+    __slots__ = ('index', 'policy', 'running', 'generation', 'dispatched_at', 'work_from',
+                 'free_since', 'last_process', 'busy', 'switch_time')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.policy = None
+        self.running = None
+        self.generation = 0
+        self.dispatched_at = 0.0
+        self.work_from = 0.0
+        self.free_since = 0.0
+        self.last_process = None
+        self.busy = 0.0
+        self.switch_time = 0.0
+
+
+class IoDevice:
+    """
+    I/O devices serving blocked processes first come first served, each
+    request taking its process's I/O burst time
+
+    Attributes:
+        servers: number of requests served at once, 0 for unlimited
+        queue: deque of (process, duration) requests waiting for a server
+        busy: number of requests in service
+    """
+    def __init__(self, servers: int = 1):
+        self.servers = servers
+        self.queue = deque()
+        self.busy = 0
+
+    def request(self, process: Process, duration: float) -> bool:
+        """
+        Queue an I/O request
+        :param process: blocked Process
+        :param duration: seconds of service the request takes
+        :return: True if a server was free and service starts now
+        """
+        if self.servers and self.busy >= self.servers:
+            self.queue.append((process, duration))
+            return False
+        self.busy += 1
+        return True
+
+    def finish(self) -> tuple:
+        """
+        Free a server after a request completes
+        :return: (process, duration) of the next request to serve, None if none wait
+        """
+        if self.queue:
+            return self.queue.popleft()
+        self.busy -= 1
+        return None
 
 
 class Scheduler:
     """
     Scheduler for Simulation.
 
-    Algorithm to use for scheduling is baked into each scheduler to abstract
-    away switch statements.
+    The scheduling algorithm is a Policy looked up in the policies registry.
+    With a global run queue a single policy feeds every core.  With per-core
+    queues each core gets its own policy instance: arrivals go to the longest
+    idle core, or round robin when none is idle, a process woken from I/O
+    returns to its last core unless that core is busy and another is idle,
+    and a core that runs dry steals from the longest queue.
 
     TODO: Attributes:
-        type: type of scheduling algorithm to use as enumerated in
-            commons.SCHEDULE_TYPES
-        quantum: Time quantum to preempt and switch to next process if applicable
-        event_queue: PriorityQueue of events to be processed
-        done: list of done processes
-        process_queue: PriorityQueue|Queue of processes to be processed
-        current_time: current system time, set by parent
-        running_process: currently running process
+        type: type of scheduling algorithm to use, a registered policy type
+            such as those in commons.SCHEDULE_TYPES
+        cores: list of Core
+        policies: Policy instances, one for a global queue or one per core
+        policy: the first (for a global queue the only) policy
+        active: policy that handled the last event, and so dispatches next
+        event_queue: EventQueue of events to be processed
+        stats: OnlineStats updated as each process completes
+        current_time: current simulation time in seconds, set by parent
+        workload: Workload|ArrayWorkload stream new processes are drawn from
+        discarded_events: number of stale timer events skipped when popped
+        switch_cost: callable returning the seconds a context switch takes
+        switches: number of context switches
+        busy: number of cores running a process
+        in_system: number of processes that arrived and are not finished
+        migrations: number of times a process resumed on a different core
+        steals: number of processes taken from another core's queue
+        blocked: number of processes waiting on or being served by the io device
+        io_device: IoDevice serving I/O bursts
+        idle_cores: heap of (free_since, index) of idle cores for routing
+            arrivals to per-core queues, entries are checked when popped
     """
-    def __init__(self, method: int, current_time: Arrow, config: dict):
+    def __init__(self,
+                 method: int,
+                 current_time: float,
+                 config: dict,
+                 workload: Workload,
+                 stats: OnlineStats = None,
+                 switch_cost=None):
         self.type = method
+        self.workload = workload
         self.config = config
-        self.event_queue = PriorityQueue()
-        self.done = []
-        self.process_queue = PriorityQueue() if method != SCHEDULE_TYPES['RR'] else Queue()
+        self.event_queue = EventQueue()
+        self.stats = stats if stats is not None else OnlineStats()
         self.current_time = current_time
-        self.running_process = None
+        self.discarded_events = 0
+        self.switch_cost = switch_cost
+        self.switches = 0
+        self.busy = 0
+        self.in_system = 0
+        self.migrations = 0
+        self.steals = 0
+        self.blocked = 0
+        self.io_device = IoDevice((config.get('io') or {}).get('devices', 1))
 
-    def check_running_process(self):
-        """Check running process and adjust appropriately"""
-        if self.type == SCHEDULE_TYPES['FCFS']:
-            self._fcfs_queue_process()
-        elif self.type == SCHEDULE_TYPES['SJF']:
-            self._sjf_queue_process()
-        elif self.type == SCHEDULE_TYPES['RR']:
-            self._rr_queue_process()
+        self.cores = [Core(index) for index in range(config.get('cores') or 1)]
+        policy = get_policy(method)
+        if config.get('per_core'):
+            self.policies = [policy(self, [core]) for core in self.cores]
         else:
-            message = "Unknown schedule type: {}".format(self.type)
-            logging.critical(message)
-            raise Exception(message)
+            self.policies = [policy(self, self.cores)]
+        self.policy = self.active = self.policies[0]
+        self.idle_cores = [(0.0, core.index) for core in self.cores]
+        self._next_core = 0
 
-    def put_process(self, process: Process):
-        """
-        Insert a process into the queue
-        :param process: Process to be inserted
-        """
-        logging.debug("%s: Inserting process: %s", self.current_time, process)
-        if self.type == SCHEDULE_TYPES['FCFS']:
-            self.process_queue.put((process.created_at, process))
-        elif self.type == SCHEDULE_TYPES['SJF']:
-            self.process_queue.put((process.run_time - process.used, process))
-        elif self.type == SCHEDULE_TYPES['RR']:
-            self.process_queue.put(process)
-
-    def _start_process(self):
-        """Start the next process from the queue"""
-        self.running_process = self.get_process()
-        logging.debug("%s: starting process: %s",
-                      self.current_time,
-                      self.running_process)
-
-    def _sjf_queue_process(self):
-        """start a process with shortest job first scheduling"""
-        if not self.process_queue.empty():
-            # Do we need to preempt a process?
-            if self.running_process:
-                process = self.running_process
-                remain = process.get_remaining()
-                next_process = self.process_queue.queue[0][1]
-                if next_process.run_time - next_process.used < remain:
-                    logging.debug("%s: offloading process: %s", self.current_time, process)
-                    self.put_process(process)
-                    self._start_process()
-            else:
-                self._start_process()
-
-        # Check if we need to queue a completion event
-        if self.running_process:
-            remain = self.running_process.get_remaining()
-            estimate = self.current_time.shift(seconds=remain)
-            if not self.event_queue.empty():
-                next_time = self.event_queue.queue[0].created_at
-                if not estimate < next_time:
-                    return
-
-            self.event_queue.put(
-                Event(created_at=estimate,
-                      event_type=EVENT_TYPES['COMPLETE'])
-            )
-
-    def _rr_queue_process(self):
-        """start a process with round robin scheduling"""
-        if not self.running_process and not self.process_queue.empty():
-            self._start_process()
-            remain = self.running_process.get_remaining()
-            if remain < self.config['quantum']:
-                logging.debug('scheduling RR completion: %s', self.running_process)
-                self.event_queue.put(
-                    Event(
-                        created_at=self.current_time.shift(seconds=remain),
-                        event_type=EVENT_TYPES['COMPLETE']
-                    )
-                )
-            else:
-                self.event_queue.put(
-                    Event(created_at=self.current_time.shift(seconds=self.config['quantum']),
-                          event_type=EVENT_TYPES['SWITCH'])
-                )
-
-    def _fcfs_queue_process(self):
-        """start a process with first come first served scheduling"""
-        if not self.running_process and not self.process_queue.empty():
-            self._start_process()
-            # Queue completion event
-            create = self.current_time.shift(seconds=self.running_process.run_time)
-            self.event_queue.put(
-                Event(created_at=create,
-                      event_type=EVENT_TYPES['COMPLETE'])
-            )
-
-    def _sjf_insert_process(self, process: Process):
-        """
-        Insert process by sjf
-        :param process: Process to be inserted
-        """
-        self.process_queue.put((process.run_time - process.used, process))
+        # Bind the routing once instead of checking the queue layout every arrival
+        if len(self.policies) > 1:
+            self._route = self._route_per_core
+        else:
+            self._route = self._route_global
+
+    def next_event(self) -> Event:
+        """
+        Pop the next live event, skipping timers from older generations
+        :return: Event, or None if no live events remain
+        """
+        cores = self.cores
+        while self.event_queue:
+            event = self.event_queue.get()
+            if event.generation is None or event.generation == cores[event.core].generation:
+                return event
+            self.discarded_events += 1
+        return None
+
+    def arm_timer(self, core: Core, delay: float, event_type: int):
+        """
+        Queue a COMPLETE or SWITCH event for a core's running process
+        :param core: Core the process was just dispatched on
+        :param delay: seconds of work, after any context switch, before the event fires
+        :param event_type: one of EVENT_TYPES
+        """
+        self.event_queue.put(
+            Event(created_at=core.work_from + delay,
+                  event_type=event_type,
+                  generation=core.generation,
+                  core=core.index)
+        )
+
+    def dispatch(self, core: Core, process: Process):
+        """
+        Start a process on an idle core, switching context if it did not run there last
+        :param core: idle Core
+        :param process: Process to run
+        """
+        now = self.current_time
+        core.running = process
+        process.state = PROCESS_STATES['RUNNING']
+        core.dispatched_at = core.work_from = now
+        self.busy += 1
+        if process.core is not None and process.core != core.index:
+            self.migrations += 1
+        process.core = core.index
+        if process is not core.last_process:
+            core.last_process = process
+            self.switches += 1
+            if self.switch_cost is not None:
+                core.work_from = now + self.switch_cost()
+        logging.debug("%s: starting process on core %s: %s", now, core.index, process)
+
+    def release(self, core: Core) -> Process:
+        """
+        Take the running process off a core, charging the work it did and
+        invalidating the core's pending timers
+        :param core: busy Core
+        :return: the Process that was running
+        """
+        now = self.current_time
+        process = core.running
+        if now > core.work_from:
+            process.set_used(core.work_from, now)
+            core.switch_time += core.work_from - core.dispatched_at
+        else:
+            # Left before its context switch finished
+            core.switch_time += now - core.dispatched_at
+        core.busy += now - core.dispatched_at
+        core.running = None
+        process.state = PROCESS_STATES['READY']
+        core.generation += 1
+        core.free_since = now
+        self.busy -= 1
+        heapq.heappush(core.policy.idle, (now, core.index))
+        if len(self.policies) > 1:
+            heapq.heappush(self.idle_cores, (now, core.index))
+        return process
+
+    def remaining(self, core: Core) -> float:
+        """Run time left for a core's running process as of now"""
+        process = core.running
+        worked = self.current_time - core.work_from
+        return process.get_remaining() - (worked if worked > 0 else 0.0)
+
+    def switch_time(self) -> float:
+        """Total seconds every core spent switching"""
+        return sum(core.switch_time for core in self.cores)
+
+    def check_running_process(self):
+        """Let the policy that handled the last event fill its idle cores"""
+        policy = self.active
+        policy.pick_next()
+        # A dry core steals only when processes are queued somewhere
+        if policy.idle and not policy.queue and self.in_system > self.busy + self.blocked:
+            self._steal(policy)
+
+    def _steal(self, thief):
+        """
+        Move the next process of the longest queue to a dry core's policy
+        :param thief: Policy with an idle core and an empty queue
+        """
+        victim = max(self.policies, key=lambda policy: len(policy.queue))
+        if not victim.queue:
+            return
+        process = victim.pop()
+        self.steals += 1
+        logging.debug("%s: core %s stealing process: %s",
+                      self.current_time, thief.cores[0].index, process)
+        thief.on_migrate(process, victim)
+        thief.pick_next()
+
+    def _route_global(self):
+        """Policy an arrival is queued with, the only one"""
+        return self.policy
+
+    def _idle_policy(self):
+        """Policy of the longest idle core, None if every core is busy"""
+        idle = self.idle_cores
+        cores = self.cores
+        while idle:
+            free_since, index = idle[0]
+            core = cores[index]
+            if core.running is None and core.free_since == free_since:
+                return core.policy
+            heapq.heappop(idle)
+        return None
+
+    def _route_per_core(self):
+        """Policy an arrival is queued with, the longest idle core's or the next in turn"""
+        policy = self._idle_policy()
+        if policy is not None:
+            return policy
+        policy = self.policies[self._next_core]
+        self._next_core = (self._next_core + 1) % len(self.policies)
+        return policy
 
     def process_event(self, event: Event):
         """
@@ -142,9 +301,11 @@ class Scheduler:
         if event.event_type == EVENT_TYPES['NEW']:
             self._process_new_event(event)
         elif event.event_type == EVENT_TYPES['COMPLETE']:
-            self._process_complete_event()
+            self._process_complete_event(event)
         elif event.event_type == EVENT_TYPES['SWITCH']:
-            self._process_switch_event()
+            self._process_switch_event(event)
+        elif event.event_type == EVENT_TYPES['IO_COMPLETE']:
+            self._process_io_complete_event(event)
         else:
             message = "Unknown event, terminating: {}".format(str(event))
             logging.critical(message)
@@ -157,21 +318,37 @@ class Scheduler:
         """
         p = event.process
         p.start_at = self.current_time
-        self.put_process(p)
+        self.in_system += 1
+        self.active = self._route()
+        self.active.on_arrival(p)
 
         # Spawn the next process
-        activate_at = self.current_time.shift(
-            seconds=rand_exp_float(self.config['rate']))
-        event = self.create_event(activate_at, p.id + 1)
+        self.spawn(p.id + 1)
+
+    def spawn(self, p_id: int):
+        """
+        Queue the creation event for the next process in the workload
+        :param p_id: id to give the new process
+        """
+        arrival = self.workload.next_process()
+        if arrival is None:
+            logging.debug('Workload exhausted, no process %s', p_id)
+            return
+        event = self.create_event(*arrival, p_id=p_id)
         self.event_queue.put(event)
         logging.debug('Queued creation event for process: %s', event.process)
 
-    def create_event(self, activate_at: Arrow, p_id: int) -> Event:
+    def create_event(self,
+                     activate_at: float,
+                     run_time: float,
+                     bursts: list = None,
+                     p_id: int = None) -> Event:
         """Create a new process"""
         process = Process(
             process_id=p_id,
-            run_time=rand_exp_float(self.config['burst_lambda']),
-            created_at=activate_at
+            run_time=run_time,
+            created_at=activate_at,
+            bursts=bursts
         )
 
         return Event(
@@ -180,29 +357,98 @@ class Scheduler:
             process=process
         )
 
-    def _process_complete_event(self):
-        """Process a completion event"""
-        self.running_process.set_completed(self.current_time)
-        self.done.append(self.running_process)
-        logging.debug("%s: Finishing process: %s", self.current_time, self.running_process)
-        self.running_process = None
+    def _process_complete_event(self, event: Event):
+        """
+        Process a completion event
+        :param event: Event to be processed
+        """
+        core = self.cores[event.core]
+        process = self.release(core)
+        self.active = core.policy
+        io_time = process.next_burst()
+        if io_time is not None:
+            self._block(process, io_time)
+            return
+        process.set_completed(self.current_time)
+        process.state = PROCESS_STATES['DONE']
+        self.in_system -= 1
+        self.stats.append(process)
+        logging.debug("%s: Finishing process: %s", self.current_time, process)
+        self.active.on_complete(process)
 
-    def _process_switch_event(self):
-        """Process a round_robin style switch event"""
-        logging.debug('%s: Processing switch event', self.current_time)
-        self.put_process(self.running_process)
-        self.running_process = None
+    def _block(self, process: Process, duration: float):
+        """
+        Block a process that finished a CPU burst until its I/O completes
+        :param process: Process that just left its core
+        :param duration: seconds of I/O
+        """
+        process.state = PROCESS_STATES['BLOCKED']
+        self.blocked += 1
+        logging.debug("%s: Blocking process for %s: %s", self.current_time, duration, process)
+        if self.io_device.request(process, duration):
+            self._start_io(process, duration)
+
+    def _start_io(self, process: Process, duration: float):
+        """Queue the I/O completion of a request entering service"""
+        self.event_queue.put(
+            Event(created_at=self.current_time + duration,
+                  event_type=EVENT_TYPES['IO_COMPLETE'],
+                  process=process)
+        )
 
-    def get_process(self) -> Process:
-        """get next process"""
-        # Hack to support simple queues.
-        if isinstance(self.process_queue, PriorityQueue):
-            return self.process_queue.get()[1]
-        return self.process_queue.get()
+    def _process_io_complete_event(self, event: Event):
+        """
+        Process an I/O completion, the process is ready for its next CPU burst
+        :param event: Event to be processed
+        """
+        waiting = self.io_device.finish()
+        if waiting is not None:
+            self._start_io(*waiting)
+        process = event.process
+        process.state = PROCESS_STATES['READY']
+        # Waiting for HRRN only counts from the end of the I/O burst
+        process.ready_at = self.current_time
+        self.blocked -= 1
+        # Back to the queue of the core it last ran on, unless that core is
+        # busy and another sits idle with nothing queued to steal from it
+        core = self.cores[process.core]
+        self.active = core.policy
+        if core.running is not None and len(self.policies) > 1:
+            idle = self._idle_policy()
+            if idle is not None:
+                self.active = idle
+                idle.on_migrate(process, core.policy)
+                return
+        self.active.on_wake(process)
+
+    def _process_switch_event(self, event: Event):
+        """
+        Process a round_robin style switch event
+        :param event: Event to be processed
+        """
+        logging.debug('%s: Processing switch event', self.current_time)
+        core = self.cores[event.core]
+        process = self.release(core)
+        self.active = core.policy
+        self.active.on_quantum(process)
 
     def offload(self):
-        """Offload current process queue"""
-        while not self.process_queue.empty():
-            process = self.get_process()
+        """Offload the running processes and current process queues"""
+        for core in self.cores:
+            if core.running is not None:
+                process = self.release(core)
+                process.set_completed(self.current_time)
+                self.stats.append(process, completed=False)
+        for policy in self.policies:
+            while policy.queue:
+                process = policy.pop()
+                process.set_completed(self.current_time)
+                self.stats.append(process, completed=False)
+        # Blocked processes only live in the event queue and io device
+        for event in self.event_queue:
+            if event.event_type == EVENT_TYPES['IO_COMPLETE']:
+                event.process.set_completed(self.current_time)
+                self.stats.append(event.process, completed=False)
+        for process, _ in self.io_device.queue:
             process.set_completed(self.current_time)
-            self.done.append(process)
+            self.stats.append(process, completed=False)
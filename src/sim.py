@@ -1,12 +1,17 @@
 """Main Simulator"""
 import logging
 from pathlib import Path
+from time import perf_counter
 import numpy as np
 from arrow import Arrow
 
-from src.commons.commons import rand_exp_float
+from src.commons.commons import run_tag
+from src.instrument import Instrumentation
+from src.tracer import EventTracer
 from src.modeller import Modeller
 from src.scheduler import Scheduler
+from src.stats import BatchMeans, RawSink, TimeWeighted, mmc_reference
+from src.workload import IoModel, IoWorkload, Workload, open_trace
 
 
 class Simulator:
@@ -17,15 +22,50 @@ class Simulator:
     For earliest job first we need to choose which job to process
     on each event process.
 
+    The event loop keeps time as plain float seconds from t=0.  Wall-clock
+    Arrow datetimes are only derived from created_at when stats are written.
+
     Attributes:
-        current_time: the current system time
-        usage: total CPU usage time in milliseconds
+        current_time: the current simulation time in seconds since start
+        events: number of events processed
+        averages: TimeWeighted integrals of queue length, CPU busy time and
+            number in system, advanced before every event
         burst_lambda: average process execution time
         process_rate: rate of process arrival
         length: length of simulation in processes
         quantum: time quantum (only for round robin)
-        created_at: used as file tag
-        method: scheduling method (see commons.SCHEDULE_TYPES)
+        created_at: wall-clock start of the run, used as file tag and epoch
+        method: scheduling method, a registered policy type (see policies)
+        rng: numpy Generator the workload is drawn from, built from the seed
+            (int, SeedSequence or Generator).  Equal seeds and rates replay
+            identical workloads.
+        raw_format: format of the streamed raw per-process output, csv, npy or
+            None to keep only the online aggregates
+        steady_state: optional dict of BatchMeans arguments (warmup, batch_size,
+            precision, min_batches).  Enables warm-up deletion and batch means
+            confidence intervals on turnaround time, and with a precision
+            target the run stops as soon as the estimate converges, length
+            then being the maximum.
+        trace: optional .npy or .csv trace of (arrival, burst) rows to replay
+            instead of drawing a synthetic workload, see workload.open_trace
+        options: optional dict of policy specific options, such as the MLFQ
+            levels, quanta and boost interval (see policies)
+        switch_cost: mean seconds a context switch takes.  The CPU is busy but
+            the incoming process makes no progress while switching.
+        switch_distribution: constant or exponential switch costs, exponential
+            costs are drawn from a stream spawned off the workload seed
+        cores: number of CPUs
+        per_core: give each core its own run queue, with work stealing,
+            instead of a single global run queue
+        io: optional dict of bursts (mean CPU bursts per process), time (mean
+            I/O burst in seconds) and devices (I/O servers, 0 for unlimited).
+            Processes block on the I/O device between CPU bursts.  Trace rows
+            with their own I/O bursts are replayed as recorded.
+        instrumentation: optional Instrumentation counting and timing the
+            event loop, written next to the run's data when it finishes
+        event_trace: optional dict of EventTracer options (capacity, sample,
+            types, ring).  Every event is then traced to a binary
+            <tag>.trace.npy in the run's raw data directory.
     """
     def __init__(self,
                  created_at: Arrow,
@@ -33,26 +73,107 @@ class Simulator:
                  burst_lambda: float = 0.06,
                  process_rate: int = 1,
                  method: int = 1,
-                 quantum: float = None):
-        self.current_time = created_at
+                 quantum: float = None,
+                 seed=None,
+                 trace: str = None,
+                 raw_format: str = 'csv',
+                 steady_state: dict = None,
+                 options: dict = None,
+                 switch_cost: float = 0.0,
+                 switch_distribution: str = 'constant',
+                 cores: int = 1,
+                 per_core: bool = False,
+                 io: dict = None,
+                 instrument: bool = False,
+                 event_trace: dict = None):
+        self.current_time = 0.0
+        self.events = 0
         self.created_at = created_at
-        self.usage = 0
+        self.averages = TimeWeighted()
+        self.raw_format = raw_format
+        self.event_trace = event_trace
 
         self.config = {
             'length': length,
             'burst_lambda': burst_lambda,
             'rate': process_rate,
-            'quantum': quantum
+            'quantum': quantum,
+            'options': options,
+            'switch_cost': switch_cost,
+            'switch_distribution': switch_distribution,
+            'cores': cores,
+            'per_core': per_core,
+            'io': io
         }
 
+        self.rng = np.random.default_rng(seed)
+        if trace is not None:
+            workload = open_trace(trace)
+        else:
+            workload = Workload(rate=process_rate,
+                                burst_lambda=burst_lambda,
+                                length=length,
+                                rng=self.rng)
+        # Trace rows recorded with their own I/O bursts pass through unchanged
+        if io and io.get('bursts', 1) > 1:
+            workload = IoWorkload(workload, IoModel(bursts=io['bursts'],
+                                                    io_time=io.get('time', 0.0),
+                                                    rng=self.substream(1)))
         self.scheduler = Scheduler(method=method,
                                    current_time=self.current_time,
-                                   config=self.config)
+                                   config=self.config,
+                                   workload=workload,
+                                   switch_cost=self.switch_sampler())
+        if steady_state:
+            self.scheduler.stats.batches = BatchMeans(**steady_state)
+        self.instrumentation = None
+        if instrument:
+            self.instrumentation = Instrumentation()
+            self.instrumentation.attach(self.scheduler)
+
+        self.tag = run_tag(self.scheduler.type,
+                           self.config['burst_lambda'],
+                           self.config['rate'],
+                           self.config['quantum'],
+                           cores)
+
+    def switch_sampler(self):
+        """
+        Build the context switch cost sampler
+        :return: callable returning the seconds one switch takes, None if switches are free
+        """
+        cost = self.config['switch_cost']
+        if not cost:
+            return None
+        distribution = self.config['switch_distribution']
+        if distribution == 'constant':
+            return lambda: cost
+        if distribution == 'exponential':
+            # A separate stream so the workload is the same with or without switch costs
+            switch_rng = self.substream(0)
+            return lambda: switch_rng.exponential(cost)
+        message = 'Unknown switch cost distribution: {}'.format(distribution)
+        logging.critical(message)
+        raise Exception(message)
 
-    def update_current_time(self, new_time: Arrow):
+    def substream(self, key: int) -> np.random.Generator:
+        """
+        Independent Generator derived from the workload seed.  Unlike
+        Generator.spawn the stream only depends on the key, not on how many
+        streams were spawned before it.
+        :param key: stream number
+        :return: numpy Generator
+        """
+        seed_seq = self.rng.bit_generator.seed_seq
+        return np.random.default_rng(np.random.SeedSequence(
+            entropy=seed_seq.entropy,
+            spawn_key=tuple(seed_seq.spawn_key) + (key,),
+            pool_size=seed_seq.pool_size))
+
+    def update_current_time(self, new_time: float):
         """
         Update system time
-        :param new_time: Arrow datetime
+        :param new_time: simulation time in seconds
         """
         self.current_time = new_time
         self.scheduler.current_time = new_time
@@ -61,42 +182,81 @@ class Simulator:
         """
         Queue 1 creation event to start simulation
         """
-        activate_at = self.current_time.shift(
-            seconds=rand_exp_float(self.config['rate'])
-        )
-        self.scheduler.event_queue.put(self.scheduler.create_event(activate_at, 1))
+        self.scheduler.spawn(1)
 
     def run(self) -> Path:
         """Run the whole simulation"""
+        if self.raw_format:
+            path = Modeller.get_raw_path(self.created_at.timestamp, self.tag, self.raw_format)
+            self.scheduler.stats.sink = RawSink(path, self.raw_format, self.created_at)
+        tracer = None
+        if self.event_trace is not None:
+            path = Modeller.get_raw_path(self.created_at.timestamp, self.tag, 'trace.npy')
+            tracer = EventTracer(path, **self.event_trace)
+            tracer.attach(self.scheduler)
+
         logging.info('%s: Bootstrapping event queue', self.current_time)
         self.bootstrap()
 
         logging.info('%s: Beginning main event loop', self.current_time)
-        while len(self.scheduler.done) < self.config['length']:
-            event = self.scheduler.event_queue.get()
-            if self.scheduler.running_process:
-                # Update usage time if CPU was busy in prev interval
-                diff = event.created_at - self.current_time
-                self.usage += diff.total_seconds()
-                self.scheduler.running_process.set_used(
-                    start=self.current_time,
-                    end=event.created_at
-                )
+        loop_start = perf_counter()
+        batches = self.scheduler.stats.batches
+        while self.scheduler.stats.count < self.config['length']:
+            if batches is not None and batches.converged:
+                logging.info('%s: Converged after %s batches', self.current_time, batches.batches)
+                break
+            event = self.scheduler.next_event()
+            if event is None:
+                logging.info('%s: Workload exhausted, ending early', self.current_time)
+                break
+            # Work done by running processes is charged when they leave their core
+            scheduler = self.scheduler
+            busy, blocked = scheduler.busy, scheduler.blocked
+            self.averages.advance(event.created_at - self.current_time,
+                                  scheduler.in_system - busy - blocked,
+                                  busy,
+                                  blocked,
+                                  scheduler.io_device.busy)
             self.update_current_time(event.created_at)
+            self.events += 1
             self.scheduler.process_event(event)
             self.scheduler.check_running_process()
 
-        members = (
-            self.scheduler.type,
-            self.config['burst_lambda'],
-            self.config['rate'],
-            self.config['quantum']
-        )
-        tag = 'type{0}_burst{1}_rate{2}_quantum{3}'.format(*members)
+        loop_end = perf_counter()
+        if tracer is not None:
+            tracer.close(self.tag)
+        logging.info('%s: Sim %s offloading! Discarded %s stale events',
+                     self.current_time, self.tag, self.scheduler.discarded_events)
 
-        logging.info('%s: Sim %s offloading!', self.current_time, tag)
+        path = self.offload(self.tag)
+        if self.instrumentation is not None:
+            self.instrumentation.loop_time = loop_end - loop_start
+            self.instrumentation.offload_time = perf_counter() - loop_end
+            self.instrumentation.write(
+                Modeller.get_profile_path(self.created_at.timestamp, self.tag, 'counters.json'))
+        return path
 
-        return self.offload(tag)
+    def check_averages(self, tolerance: float = 1e-6) -> float:
+        """
+        Sanity check the time-weighted averages against Little's law and log
+        them next to the M/M/c reference values for this rate and core count.
+        :param tolerance: relative error above which a warning is logged
+        :return: relative Little's law error
+        """
+        error = self.averages.littles_law_error(self.scheduler.stats.turnaround_time())
+        if error > tolerance:
+            logging.warning('%s: Little\'s law violated by %s in %s',
+                            self.current_time, error, self.tag)
+        cores = len(self.scheduler.cores)
+        reference = mmc_reference(self.config['rate'], self.config['burst_lambda'], cores)
+        logging.info('%s: %s utilization %s (M/M/c %s), in system %s (M/M/c %s)',
+                     self.current_time,
+                     self.tag,
+                     self.averages.utilization() / cores,
+                     reference['utilization'],
+                     self.averages.mean_in_system(),
+                     reference['in_system'])
+        return error
 
     def offload(self, tag: str) -> Path:
         """
@@ -109,17 +269,35 @@ class Simulator:
 
         # offload processes still in queue
         self.scheduler.offload()
+        self.scheduler.stats.close()
+        self.check_averages()
 
         kwargs = {
-            'in_list': np.array(self.scheduler.done),
+            'stats': self.scheduler.stats,
             'path': tag,
             'created_at': self.created_at.timestamp,
-            'length': self.config['length'],
-            'usage': self.usage,
-            'total_time': (self.current_time - self.created_at).total_seconds(),
+            # Fewer than length may finish if the run converged or ran dry
+            'length': self.scheduler.stats.completed,
+            # Utilization is averaged over the cores
+            'usage': self.averages.busy / len(self.scheduler.cores),
+            'avg_queue': self.averages.mean_queue_length(),
+            'avg_in_system': self.averages.mean_in_system(),
+            'littles_law_error': self.averages.littles_law_error(
+                self.scheduler.stats.turnaround_time()),
+            'total_time': self.current_time,
             'given_lambda': self.config['rate'],
+            'burst_lambda': self.config['burst_lambda'],
             'type': self.scheduler.type,
-            'quantum': self.config['quantum']
+            'label': self.scheduler.policy.label(self.config['quantum']),
+            'quantum': self.config['quantum'],
+            'switches': self.scheduler.switches,
+            'switch_time': self.scheduler.switch_time() / len(self.scheduler.cores),
+            'cores': len(self.scheduler.cores),
+            'migrations': self.scheduler.migrations,
+            'core_utilization': [core.busy / self.current_time for core in self.scheduler.cores],
+            'io_utilization': self.averages.io_utilization(),
+            'avg_blocked': self.averages.mean_blocked(),
+            'cpu_io_overlap': self.averages.cpu_io_overlap()
         }
 
         return modeller.write_stats(**kwargs)
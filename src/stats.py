@@ -0,0 +1,530 @@
+"""Statistics for completed processes"""
+import math
+import shutil
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from arrow import Arrow
+
+from src.commons.commons import exp_scale
+
+
+class ProcessTable:
+    """
+    Completed process metrics stored in preallocated numpy columns.
+
+    Finished processes are copied into one row of a 2D float array so the
+    Process objects themselves can be freed.  Used as the chunk buffer of
+    RawSink.  Capacity doubles if more rows are appended than expected.
+
+    Attributes:
+        COLUMNS: names of the stored columns, in order
+        data: (capacity, len(COLUMNS)) float array, only the first len(self) rows are valid
+    """
+    COLUMNS = ('id', 'created_at', 'start_at', 'run_time', 'total_time', 'used', 'completed_at')
+
+    def __init__(self, capacity: int = 1024):
+        self.data = np.empty((max(1, capacity), len(ProcessTable.COLUMNS)), dtype=np.float64)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, process):
+        """
+        Record a completed process
+        :param process: Process to record, start_at may be None
+        """
+        if self._size == len(self.data):
+            self.data = np.concatenate((self.data, np.empty_like(self.data)))
+        start_at = process.start_at if process.start_at is not None else np.nan
+        self.data[self._size] = (process.id,
+                                 process.created_at,
+                                 start_at,
+                                 process.run_time,
+                                 process.total_time,
+                                 process.used,
+                                 process.completed_at)
+        self._size += 1
+
+    def clear(self):
+        """Forget recorded rows, keeping the allocated capacity"""
+        self._size = 0
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Get a view of one column of the recorded rows
+        :param name: one of COLUMNS
+        :return: 1D float array of length len(self)
+        """
+        return self.data[:self._size, ProcessTable.COLUMNS.index(name)]
+
+
+class LogHistogram:
+    """
+    Fixed-bin histogram with logarithmically spaced bins for percentiles.
+
+    Memory is constant however many values are added.  Values below the
+    lowest edge (including zero) fall into an underflow bin and values
+    above the highest edge into an overflow bin.
+
+    Attributes:
+        low: log10 of the lowest bin edge
+        high: log10 of the highest bin edge
+        per_decade: number of bins per power of ten
+        counts: numpy array of bin counts, [underflow, bins..., overflow]
+    """
+    def __init__(self, low: float = -6, high: float = 6, per_decade: int = 50):
+        self.low = low
+        self.high = high
+        self.per_decade = per_decade
+        self._bins = int((high - low) * per_decade)
+        self.counts = np.zeros(self._bins + 2, dtype=np.int64)
+
+    def add(self, value: float):
+        """
+        Count one value
+        :param value: non-negative value to add
+        """
+        if value <= 0:
+            self.counts[0] += 1
+            return
+        index = int((math.log10(value) - self.low) * self.per_decade) + 1
+        self.counts[min(max(index, 0), self._bins + 1)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate a percentile, interpolating within a bin on a log scale
+        :param q: percentile in [0, 100]
+        :return: estimated value, nan if the histogram is empty
+        """
+        total = self.counts.sum()
+        if not total:
+            return float('nan')
+        rank = q / 100 * total
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, rank))
+        if index == 0:
+            return 0.0
+        index = min(index, self._bins)
+        before = cumulative[index - 1]
+        fraction = (rank - before) / self.counts[index] if self.counts[index] else 1.0
+        return 10 ** (self.low + (index - 1 + fraction) / self.per_decade)
+
+
+# Two sided 95% Student t critical values for 1..30 degrees of freedom
+T_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+
+class BatchMeans:
+    """
+    Steady-state estimate of a mean by the method of batch means.
+
+    The first warmup values are deleted to remove the initial transient,
+    the rest are grouped into fixed-size batches and the batch means are
+    treated as approximately independent samples.  Batch means are folded
+    into a running mean and variance so memory is constant.
+
+    Attributes:
+        warmup: number of initial values discarded
+        batch_size: number of values per batch
+        precision: target 95% half-width as a fraction of the mean, None to never converge
+        min_batches: batches required before the estimate can converge
+        batches: number of completed batches
+        converged: True once the half-width target has been met
+    """
+    def __init__(self,
+                 warmup: int = 1000,
+                 batch_size: int = 1000,
+                 precision: float = None,
+                 min_batches: int = 10):
+        self.warmup = warmup
+        self.batch_size = batch_size
+        self.precision = precision
+        self.min_batches = min_batches
+        self.batches = 0
+        self.converged = False
+        self._seen = 0
+        self._batch_sum = 0.0
+        self._batch_count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float) -> bool:
+        """
+        Add one observation
+        :param value: observed value
+        :return: True if this value completed a batch
+        """
+        self._seen += 1
+        if self._seen <= self.warmup:
+            return False
+        self._batch_sum += value
+        self._batch_count += 1
+        if self._batch_count < self.batch_size:
+            return False
+
+        # Welford update over the batch means
+        batch_mean = self._batch_sum / self._batch_count
+        self._batch_sum = 0.0
+        self._batch_count = 0
+        self.batches += 1
+        delta = batch_mean - self._mean
+        self._mean += delta / self.batches
+        self._m2 += delta * (batch_mean - self._mean)
+        if self.precision is not None and self.batches >= self.min_batches:
+            self.converged = self.half_width() <= self.precision * abs(self._mean)
+        return True
+
+    def mean(self) -> float:
+        """Grand mean of the completed batches, nan if there are none"""
+        return self._mean if self.batches else float('nan')
+
+    def half_width(self) -> float:
+        """95% confidence interval half-width of the mean, nan below two batches"""
+        if self.batches < 2:
+            return float('nan')
+        dof = self.batches - 1
+        critical = T_95[dof - 1] if dof <= len(T_95) else 1.96
+        return critical * math.sqrt(self._m2 / dof / self.batches)
+
+
+class OnlineStats:
+    """
+    Streaming accumulator for completed process statistics.
+
+    Every metric is updated in O(1) as each process completes so finished
+    processes are never retained.  Per-process rows are forwarded to an
+    optional RawSink.
+
+    Attributes:
+        count: number of recorded processes
+        completed: number of recorded processes that actually finished
+        turnaround: total turnaround time in seconds
+        wait: total waiting time in seconds
+        used: total CPU time used in seconds
+        turnaround_hist: LogHistogram of turnaround times
+        wait_hist: LogHistogram of waiting times
+        sink: optional RawSink for raw per-process output
+        batches: optional BatchMeans steady-state estimate of turnaround time
+    """
+    def __init__(self, sink=None, batches: BatchMeans = None):
+        self.count = 0
+        self.completed = 0
+        self.turnaround = 0.0
+        self.wait = 0.0
+        self.used = 0.0
+        self.turnaround_hist = LogHistogram()
+        self.wait_hist = LogHistogram()
+        self.sink = sink
+        self.batches = batches
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, process, completed: bool = True):
+        """
+        Record a completed process
+        :param process: completed Process
+        :param completed: False for processes cut off by the end of the run,
+            they are left out of the steady-state batch means
+        """
+        total = process.total_time
+        wait = total - process.used
+        self.count += 1
+        self.turnaround += total
+        self.wait += wait
+        self.used += process.used
+        self.turnaround_hist.add(total)
+        self.wait_hist.add(wait)
+        if completed:
+            self.completed += 1
+            if self.batches is not None:
+                self.batches.add(total)
+        if self.sink is not None:
+            self.sink.append(process)
+
+    def turnaround_time(self) -> float:
+        """Total turnaround time of all recorded processes in seconds"""
+        return self.turnaround
+
+    def wait_time(self) -> float:
+        """Total time recorded processes spent waiting in seconds"""
+        return self.wait
+
+    def percentiles(self, quantiles: tuple = (50, 95, 99)) -> tuple:
+        """
+        Estimated turnaround time percentiles
+        :param quantiles: percentiles to estimate
+        :return: tuple of seconds, one per quantile
+        """
+        return tuple(self.turnaround_hist.percentile(q) for q in quantiles)
+
+    def steady_state(self) -> tuple:
+        """
+        Steady-state turnaround estimate
+        :return: (batch means mean, 95% half-width), nan if not enabled
+        """
+        if self.batches is None:
+            return float('nan'), float('nan')
+        return self.batches.mean(), self.batches.half_width()
+
+    def close(self):
+        """Flush and close the raw sink, if any"""
+        if self.sink is not None:
+            self.sink.close()
+
+
+class TimeWeighted:
+    """
+    Time-weighted integrals of queue length, CPU busy time and number in system.
+
+    Simulator.run advances the integrals by the time since the previous
+    event before handling each event, which is O(1) per event, so true time
+    averages are available at the end of the run with no post-processing.
+
+    Attributes:
+        elapsed: total simulated time integrated over in seconds
+        queue_area: integral of ready queue length over time
+        busy: total time the CPU was busy in seconds
+        system_area: integral of processes in system (queued + running + blocked) over time
+        blocked_area: integral of processes blocked on I/O over time
+        io_busy: integral of busy I/O servers over time
+        overlap: total time a CPU and an I/O server were both busy in seconds
+    """
+    def __init__(self):
+        self.elapsed = 0.0
+        self.queue_area = 0.0
+        self.busy = 0.0
+        self.system_area = 0.0
+        self.blocked_area = 0.0
+        self.io_busy = 0.0
+        self.overlap = 0.0
+
+    def advance(self,
+                duration: float,
+                queue_length: int,
+                running: int,
+                blocked: int = 0,
+                io_busy: int = 0):
+        """
+        Integrate over an interval in which nothing changed
+        :param duration: length of the interval in seconds
+        :param queue_length: processes in the ready queue during the interval
+        :param running: processes on the CPU during the interval
+        :param blocked: processes waiting on or served by the I/O device
+        :param io_busy: busy I/O servers during the interval
+        """
+        self.elapsed += duration
+        self.queue_area += queue_length * duration
+        self.busy += running * duration
+        self.system_area += (queue_length + running + blocked) * duration
+        if blocked:
+            self.blocked_area += blocked * duration
+            self.io_busy += io_busy * duration
+            if running:
+                self.overlap += duration
+
+    def mean_queue_length(self) -> float:
+        """Time-average number of processes in the ready queue"""
+        return self.queue_area / self.elapsed if self.elapsed else 0.0
+
+    def mean_in_system(self) -> float:
+        """Time-average number of processes queued or running"""
+        return self.system_area / self.elapsed if self.elapsed else 0.0
+
+    def utilization(self) -> float:
+        """Fraction of time the CPU was busy"""
+        return self.busy / self.elapsed if self.elapsed else 0.0
+
+    def mean_blocked(self) -> float:
+        """Time-average number of processes blocked on I/O"""
+        return self.blocked_area / self.elapsed if self.elapsed else 0.0
+
+    def io_utilization(self) -> float:
+        """Time-average number of busy I/O servers"""
+        return self.io_busy / self.elapsed if self.elapsed else 0.0
+
+    def cpu_io_overlap(self) -> float:
+        """Fraction of time a CPU and an I/O server were both busy"""
+        return self.overlap / self.elapsed if self.elapsed else 0.0
+
+    def littles_law_error(self, turnaround_time: float) -> float:
+        """
+        Relative error of Little's law L = lambda * W over the run.
+        With every process leaving by the end of the run, lambda * W * T is
+        the total turnaround time, which must equal the system area.
+        :param turnaround_time: total turnaround time of every process in seconds
+        :return: |L - lambda * W| / L, 0 for an empty run
+        """
+        if not self.system_area:
+            return 0.0
+        return abs(self.system_area - turnaround_time) / self.system_area
+
+
+def mmc_reference(rate: float, burst_lambda: float, servers: int) -> dict:
+    """
+    M/M/c reference values for Poisson arrivals, exponential bursts and c
+    identical CPUs sharing one queue, from the Erlang C formula
+    :param rate: process arrival rate per second
+    :param burst_lambda: average process execution time (see commons.exp_scale)
+    :param servers: number of CPUs
+    :return: dict of per CPU utilization, mean number in system and mean
+        turnaround, the latter two are inf when the system is overloaded
+    """
+    load = exp_scale(burst_lambda) * rate
+    rho = load / servers
+    if rho >= 1:
+        return {'utilization': 1.0, 'in_system': float('inf'), 'turnaround': float('inf')}
+    # Terms load^k / k! built incrementally, so large core counts do not overflow
+    term, total = 1.0, 0.0
+    for k in range(servers):
+        total += term
+        term *= load / (k + 1)
+    waiting = term / (1 - rho)
+    erlang_c = waiting / (total + waiting)
+    in_system = erlang_c * rho / (1 - rho) + load
+    return {'utilization': rho,
+            'in_system': in_system,
+            'turnaround': in_system / rate}
+
+
+class RawSink:
+    """
+    Streams raw per-process rows to disk in fixed-size chunks.
+
+    Rows are buffered in a ProcessTable and flushed whenever it fills, so
+    memory stays constant however long the run.  csv output converts times
+    to wall-clock datetimes, npy output is a structured array of simulation
+    seconds named by ProcessTable.COLUMNS.
+
+    Attributes:
+        path: file the rows are written to
+        raw_format: csv or npy
+        epoch: Arrow datetime the simulation started at
+        rows: number of rows written so far
+    """
+    CHUNK_SIZE = 8192
+    DTYPE = np.dtype([(name, np.float64) for name in ProcessTable.COLUMNS])
+
+    def __init__(self, path: Path, raw_format: str, epoch: Arrow, chunk_size: int = CHUNK_SIZE):
+        if raw_format not in ('csv', 'npy'):
+            raise ValueError('Unknown raw format: {}'.format(raw_format))
+        self.path = Path(str(path))
+        self.raw_format = raw_format
+        self.epoch = epoch
+        self.rows = 0
+        self._buffer = ProcessTable(capacity=chunk_size)
+        self._body = Path('{}.part'.format(self.path)) if raw_format == 'npy' else self.path
+        self._file = open(str(self._body), 'wb')
+        if raw_format == 'csv':
+            self._file.write((','.join(ProcessTable.COLUMNS) + '\n').encode())
+
+    def append(self, process):
+        """
+        Buffer one completed process, flushing when the buffer is full
+        :param process: completed Process
+        """
+        self._buffer.append(process)
+        if len(self._buffer) == len(self._buffer.data):
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows"""
+        if not len(self._buffer):
+            return
+        if self.raw_format == 'csv':
+            np.savetxt(self._file, self._csv_columns(), fmt='%s', delimiter=',')
+        else:
+            self._file.write(self._buffer.data[:len(self._buffer)].tobytes())
+        self.rows += len(self._buffer)
+        self._buffer.clear()
+
+    def _csv_columns(self) -> np.ndarray:
+        """Buffered rows as a 2D string array, times converted to wall clock"""
+        columns = []
+        for name in ProcessTable.COLUMNS:
+            values = self._buffer.column(name)
+            if name == 'id':
+                columns.append(values.astype(np.int64).astype(str))
+            elif name.endswith('_at'):
+                columns.append(to_wall_clock(self.epoch, values))
+            else:
+                columns.append(values.astype(str))
+        return np.column_stack(columns)
+
+    def close(self):
+        """Flush remaining rows and finalise the file"""
+        self.flush()
+        self._file.close()
+        if self.raw_format == 'npy':
+            finish_npy(self.path, self._body, RawSink.DTYPE, self.rows)
+
+
+def finish_npy(path: Path, body: Path, dtype: np.dtype, rows: int):
+    """
+    Write a .npy file from a body of raw rows streamed to disk without a
+    header, whose row count is only known once they are all written
+    :param path: .npy file to write
+    :param body: file of rows of dtype, deleted once copied
+    :param dtype: numpy dtype of one row
+    :param rows: number of rows in body
+    """
+    header = {'descr': np.lib.format.dtype_to_descr(dtype),
+              'fortran_order': False,
+              'shape': (rows,)}
+    with open(str(path), 'wb') as out, open(str(body), 'rb') as source:
+        np.lib.format.write_array_header_1_0(out, header)
+        shutil.copyfileobj(source, out)
+    body.unlink()
+
+
+def to_wall_clock(epoch: Arrow, seconds: np.ndarray) -> np.ndarray:
+    """
+    Convert simulation times to wall-clock ISO 8601 strings in one pass
+    :param epoch: Arrow datetime the simulation started at
+    :param seconds: array of simulation times in seconds since epoch, NaN if unset
+    :return: array of UTC datetime strings, or seconds unchanged if epoch is None
+    """
+    if epoch is None:
+        return seconds
+    base = np.datetime64(epoch.to('utc').naive, 'us')
+    offsets = np.round(seconds * 1e6)
+    stamps = base + np.nan_to_num(offsets).astype('timedelta64[us]')
+    stamps[np.isnan(offsets)] = np.datetime64('NaT')
+    return np.char.add(np.datetime_as_string(stamps, unit='us'), '+00:00')
+
+
+def rebase_raw_csv(source: Path,
+                   destination: Path,
+                   old_epoch: Arrow,
+                   new_epoch: Arrow,
+                   chunk_size: int = RawSink.CHUNK_SIZE):
+    """
+    Copy csv raw output written by RawSink, moving its wall-clock times from
+    the epoch it was written with to another, in whole microseconds so the
+    copy matches what a run started at new_epoch writes
+    :param source: csv raw output
+    :param destination: file to write
+    :param old_epoch: Arrow datetime the source's simulation started at
+    :param new_epoch: Arrow datetime the copy's times are relative to
+    :param chunk_size: number of rows converted at a time
+    """
+    shift = np.datetime64(new_epoch.to('utc').naive, 'us') - \
+        np.datetime64(old_epoch.to('utc').naive, 'us')
+    times = [i for i, name in enumerate(ProcessTable.COLUMNS) if name.endswith('_at')]
+    with open(str(source), 'rb') as src, open(str(destination), 'wb') as out:
+        out.write(src.readline())
+        while True:
+            lines = list(islice(src, chunk_size))
+            if not lines:
+                return
+            rows = np.array([line.decode().rstrip('\n').split(',') for line in lines])
+            for i in times:
+                stamps = np.char.replace(rows[:, i], '+00:00', '').astype('datetime64[us]')
+                rows[:, i] = np.char.add(np.datetime_as_string(stamps + shift, unit='us'),
+                                         '+00:00')
+            np.savetxt(out, rows, fmt='%s', delimiter=',')
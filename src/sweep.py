@@ -0,0 +1,254 @@
+"""Sweep planning and execution over a process pool"""
+import concurrent.futures
+import cProfile
+import itertools
+import json
+import logging
+import math
+from pathlib import Path
+
+import numpy as np
+
+from arrow import Arrow
+
+from src.commons.commons import exp_scale, run_tag
+from src.modeller import Modeller
+from src.policies import get_policy, load_plugins
+from src.sim import Simulator
+
+
+def run_sim(method: int,
+            prefix: Arrow,
+            rate: int,
+            length: int,
+            quantum: float = None,
+            seed=None,
+            trace: str = None,
+            raw_format: str = 'csv',
+            steady_state: dict = None,
+            burst_lambda: float = 0.06,
+            options: dict = None,
+            switch_cost: float = 0.0,
+            switch_distribution: str = 'constant',
+            cores: int = 1,
+            per_core: bool = False,
+            io: dict = None,
+            instrument: bool = False,
+            profile: bool = False,
+            event_trace: dict = None) -> Path:
+    """
+    run sim with given parameters
+    :param method: scheduler method, a registered policy type
+    :param prefix: folder prefix for data, usually unix timestamp
+    :param rate: rate of process arrival
+    :param length: length of simulation in processes
+    :param quantum: time quantum (only for round robin)
+    :param seed: int or SeedSequence for the workload, see commons.make_seed
+    :param trace: optional .npy or .csv workload trace to replay instead
+    :param raw_format: format of raw per-process output, csv, npy or None
+    :param steady_state: optional batch means config, see Simulator
+    :param burst_lambda: average process execution time
+    :param options: optional policy specific options, see Simulator
+    :param switch_cost: mean seconds a context switch takes
+    :param switch_distribution: constant or exponential switch costs
+    :param cores: number of CPUs
+    :param per_core: per-core run queues with work stealing instead of a global queue
+    :param io: optional I/O burst config, see Simulator
+    :param instrument: count and time events by type, see instrument.Instrumentation
+    :param profile: run under cProfile, writing data/<prefix>/<run tag>.pstats
+    :param event_trace: optional binary event tracing options, see Simulator
+    :return: Path to high level stats
+    """
+    simulator = Simulator(
+        method=method,
+        created_at=prefix,
+        quantum=quantum,
+        process_rate=rate,
+        length=length,
+        seed=seed,
+        trace=trace,
+        raw_format=raw_format,
+        steady_state=steady_state,
+        burst_lambda=burst_lambda,
+        options=options,
+        switch_cost=switch_cost,
+        switch_distribution=switch_distribution,
+        cores=cores,
+        per_core=per_core,
+        io=io,
+        instrument=instrument,
+        event_trace=event_trace
+    )
+    if not profile:
+        return simulator.run()
+    profiler = cProfile.Profile()
+    path = profiler.runcall(simulator.run)
+    profiler.dump_stats(str(Modeller.get_profile_path(prefix.timestamp, simulator.tag, 'pstats')))
+    return path
+
+
+def task_tag(task: dict) -> str:
+    """
+    Tag of the files a task's simulation writes
+    :param task: run_sim keyword arguments
+    :return: tag, see commons.run_tag
+    """
+    return run_tag(task['method'], task['burst_lambda'], task['rate'], task['quantum'],
+                   task.get('cores', 1))
+
+
+DEFAULT_SPEC = {
+    'schedulers': ['FCFS', 'SJF', 'SRTF', 'HRRN', 'RR', 'MLFQ'],
+    'quanta': [0.01, 0.2],
+    'burst_lambdas': [0.06],
+    'cores': [1],
+    'options': {}
+}
+
+
+def load_spec(path) -> dict:
+    """
+    Read a JSON sweep spec.  Every key is optional and falls back to
+    DEFAULT_SPEC, rates default to the CLI max_rate:
+        {"schedulers": ["FCFS", "SJF", "SRTF", "HRRN", "RR", "MLFQ"],
+         "rates": [0.5, 1, 2] or {"start": 0.5, "stop": 30, "num": 20, "log": true},
+         "quanta": [0.01, 0.05, 0.2],
+         "burst_lambdas": [0.06],
+         "cores": [1, 2, 4],
+         "options": {"MLFQ": {"levels": 3, "boost": 1.0}}}
+    :param path: path to the spec file
+    :return: spec dict
+    """
+    with open(str(path)) as file:
+        return json.load(file)
+
+
+def spec_rates(rates) -> list:
+    """
+    Expand the rates of a spec
+    :param rates: list of rates, or dict of start, stop, num and optional log
+        for evenly (or logarithmically) spaced rates
+    :return: list of rates rounded to 6 significant figures, whole rates as ints
+    """
+    if isinstance(rates, dict):
+        space = np.geomspace if rates.get('log') else np.linspace
+        rates = space(rates['start'], rates['stop'], int(rates['num'])).tolist()
+    rounded = (float('{:.6g}'.format(rate)) for rate in rates)
+    return [int(rate) if rate.is_integer() else rate for rate in rounded]
+
+
+def expand_grid(spec: dict) -> list:
+    """
+    Cartesian product of scheduler, rate, quantum, burst_lambda and cores.
+    Schedulers that take no quantum get a single cell with quantum None, and
+    schedulers whose options list a quantum per level a single cell with
+    the top level's quantum.
+    :param spec: spec dict, see load_spec
+    :return: list of dicts of method, rate, quantum, burst_lambda, cores and options
+    """
+    spec = dict(DEFAULT_SPEC, **spec)
+    cells = []
+    for name in spec['schedulers']:
+        policy = get_policy(name if isinstance(name, str) else int(name))
+        method = policy.type
+        quanta = spec['quanta'] if policy.takes_quantum else [None]
+        options = spec['options'].get(policy.name)
+        if options and options.get('quanta'):
+            # Per level quanta replace the swept quantum, labelled by the top level's
+            quanta = [options['quanta'][0]]
+        product = itertools.product(quanta,
+                                    spec['burst_lambdas'],
+                                    spec['cores'],
+                                    spec_rates(spec['rates']))
+        for quantum, burst_lambda, cores, rate in product:
+            cells.append({'method': method,
+                          'rate': rate,
+                          'quantum': quantum,
+                          'burst_lambda': burst_lambda,
+                          'cores': cores,
+                          'options': options})
+    return cells
+
+
+def run_batch(tasks: list) -> list:
+    """
+    Run several simulations in one pool task
+    :param tasks: list of run_sim keyword argument dicts
+    :return: list of (task, Path to high level stats) tuples
+    """
+    return [(task, run_sim(**task)) for task in tasks]
+
+
+def estimate_cost(task: dict, burst_lambda: float = 0.06) -> float:
+    """
+    Rough relative cost of a simulation, in heap operations.
+    Every process costs an arrival and a completion, plus one switch per
+    quantum for quantum based schedulers.  Each event costs log of the ready queue
+    length, estimated from the offered load rho = rate * mean burst:
+    rho / (1 - rho) when stable, and for an overloaded system the backlog
+    grows linearly so the average queue is about length * (rho - 1) / 2.
+    :param task: run_sim keyword arguments
+    :param burst_lambda: average process execution time if the task has none
+    :return: estimated cost, only meaningful relative to other tasks
+    """
+    burst = exp_scale(task.get('burst_lambda', burst_lambda))
+    rho = burst * task['rate'] / task.get('cores', 1)
+    if rho < 1:
+        queue = rho / (1 - rho)
+    else:
+        queue = task['length'] * (rho - 1) / 2
+    # A block and an I/O completion between CPU bursts
+    io = task.get('io') or {}
+    events = 2.0 + 2 * (io.get('bursts', 1) - 1)
+    if get_policy(task['method']).takes_quantum and task.get('quantum'):
+        events += burst / task['quantum']
+    return task['length'] * events * (1 + math.log2(1 + queue))
+
+
+def plan(tasks: list, chunksize: int = 1) -> list:
+    """
+    Order tasks longest first and group them into pool submissions.
+    Submitting the most expensive tasks first keeps stragglers from
+    leaving most workers idle at the end of the sweep.  Cheap tasks are
+    grouped up to chunksize per submission, but a submission never grows
+    past the cost of the single most expensive task.
+    :param tasks: list of run_sim keyword argument dicts
+    :param chunksize: maximum number of tasks per submission
+    :return: list of task lists, most expensive first
+    """
+    costed = sorted(((estimate_cost(task), task) for task in tasks),
+                    key=lambda pair: pair[0], reverse=True)
+    if not costed:
+        return []
+
+    limit = costed[0][0]
+    batches = []
+    batch, batch_cost = [], 0.0
+    for cost, task in costed:
+        if batch and (len(batch) >= chunksize or batch_cost + cost > limit):
+            batches.append(batch)
+            batch, batch_cost = [], 0.0
+        batch.append(task)
+        batch_cost += cost
+    batches.append(batch)
+    return batches
+
+
+def run_sweep(tasks: list, workers: int = None, chunksize: int = 1, plugins=()):
+    """
+    Run tasks on a process pool, yielding results as each one finishes
+    :param tasks: list of run_sim keyword argument dicts
+    :param workers: number of worker processes, defaults to the cpu count
+    :param chunksize: number of tasks per submission
+    :param plugins: modules registering extra policies, imported in every worker
+    :return: generator of (task, Path to high level stats) tuples
+    """
+    batches = plan(tasks, chunksize)
+    logging.info('Submitting %s tasks in %s batches', len(tasks), len(batches))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=load_plugins,
+                                                initargs=(tuple(plugins),)) as executor:
+        futures = [executor.submit(run_batch, batch) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            for result in future.result():
+                yield result
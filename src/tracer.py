@@ -0,0 +1,180 @@
+"""Low overhead binary tracing of scheduler events"""
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from src.commons.commons import EVENT_TYPES, EVENT_NAMES
+from src.stats import finish_npy
+
+
+class EventTracer:
+    """
+    Records one (time, event_type, pid, queue_len, core) row per scheduler
+    event into a preallocated buffer and writes it to disk in bulk.
+
+    The trace is a .npy structured array of EventTracer.DTYPE, written like
+    RawSink's npy output, with a .json sidecar holding the tracing options.
+    Each simulation writes its own files, so pool workers never share one.
+    With ring set only the last capacity rows are kept, otherwise the
+    buffer is flushed every time it fills.
+
+    Attributes:
+        path: .npy file the rows are written to
+        capacity: number of rows buffered between flushes, or kept by a ring
+        sample: record every sample-th matching event
+        types: set of event types recorded, None for every type
+        ring: keep only the last capacity rows instead of every row
+        rows: number of rows written so far
+        seen: number of matching events, sampled or not
+        recorded: number of sampled rows, written or not
+        dropped: number of rows overwritten by the ring
+    """
+    CAPACITY = 65536
+    DTYPE = np.dtype([('time', '<f8'),
+                      ('event_type', 'u1'),
+                      ('pid', '<i8'),
+                      ('queue_len', '<i4'),
+                      ('core', '<i2')])
+
+    def __init__(self,
+                 path: Path,
+                 capacity: int = CAPACITY,
+                 sample: int = 1,
+                 types=None,
+                 ring: bool = False):
+        self.path = Path(str(path))
+        self.capacity = capacity
+        self.sample = sample
+        self.types = None if types is None else {event_type_number(event_type)
+                                                 for event_type in types}
+        self.ring = ring
+        self.rows = 0
+        self.seen = 0
+        self.recorded = 0
+        self.dropped = 0
+        self._buffer = [None] * capacity
+        self._index = 0
+        self._wrapped = False
+        self._body = Path('{}.part'.format(self.path))
+        self._file = open(str(self._body), 'wb')
+
+    def attach(self, scheduler):
+        """
+        Trace every event a scheduler processes.  Rebinds process_event on
+        that one instance, so an untraced scheduler pays nothing.
+        :param scheduler: Scheduler to trace
+        """
+        process_event = scheduler.process_event
+        cores = scheduler.cores
+        types = self.types
+        sample = self.sample
+
+        def traced_process_event(event):
+            process = event.process
+            if process is None:
+                # Timer events only name their core, trace the process they stop
+                process = cores[event.core].running
+            process_event(event)
+            if types is not None and event.event_type not in types:
+                return
+            self.seen += 1
+            if sample > 1 and self.seen % sample:
+                return
+            self.recorded += 1
+            core = process.core
+            self._buffer[self._index] = (
+                scheduler.current_time,
+                event.event_type,
+                process.id,
+                scheduler.in_system - scheduler.busy - scheduler.blocked,
+                -1 if core is None else core)
+            self._index += 1
+            if self._index == self.capacity:
+                self._full()
+
+        scheduler.process_event = traced_process_event
+
+    def _full(self):
+        """The buffer filled up, flush it or wrap around"""
+        if self.ring:
+            self._wrapped = True
+            self._index = 0
+        else:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows, oldest first"""
+        if self._wrapped:
+            rows = self._buffer[self._index:] + self._buffer[:self._index]
+            self.dropped = self.recorded - self.capacity
+            self._wrapped = False
+        else:
+            rows = self._buffer[:self._index]
+        if rows:
+            self._file.write(np.array(rows, dtype=EventTracer.DTYPE).tobytes())
+        self.rows += len(rows)
+        self._index = 0
+
+    def close(self, tag: str = None):
+        """
+        Flush remaining rows and finalise the trace and its sidecar
+        :param tag: run tag stored in the sidecar
+        """
+        self.flush()
+        self._file.close()
+        finish_npy(self.path, self._body, EventTracer.DTYPE, self.rows)
+
+        meta = {'tag': tag,
+                'rows': self.rows,
+                'seen': self.seen,
+                'recorded': self.recorded,
+                'dropped': self.dropped,
+                'sample': self.sample,
+                'ring': self.ring,
+                'types': None if self.types is None else sorted(self.types),
+                'event_types': {str(event_type): name for event_type, name in EVENT_NAMES.items()}}
+        with open(str(trace_meta_path(self.path)), 'w') as file:
+            json.dump(meta, file, indent=2, sort_keys=True)
+
+
+def event_type_number(event_type) -> int:
+    """
+    Resolve an event type
+    :param event_type: EVENT_TYPES number or name, e.g. 2 or 'COMPLETE'
+    :return: EVENT_TYPES number
+    """
+    if isinstance(event_type, str):
+        name = event_type.strip().upper()
+        if name.isdigit():
+            event_type = int(name)
+        elif name in EVENT_TYPES:
+            return EVENT_TYPES[name]
+    if event_type not in EVENT_TYPES.values():
+        message = 'Unknown event type: {}'.format(event_type)
+        logging.critical(message)
+        raise Exception(message)
+    return event_type
+
+
+def trace_meta_path(path: Path) -> Path:
+    """Sidecar of a trace file holding its tracing options"""
+    path = Path(str(path))
+    return path.with_name(path.name[:-len(path.suffix)] + '.json')
+
+
+def load_trace(path) -> tuple:
+    """
+    Open a trace written by EventTracer
+    :param path: .npy trace file
+    :return: (memory mapped structured array of EventTracer.DTYPE, sidecar
+        dict, empty if the sidecar is missing)
+    """
+    records = np.load(str(path), mmap_mode='r')
+    meta_path = trace_meta_path(path)
+    meta = {}
+    if meta_path.exists():
+        with open(str(meta_path)) as file:
+            meta = json.load(file)
+    return records, meta
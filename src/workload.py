@@ -0,0 +1,418 @@
+"""Workload generation and trace input/output"""
+import csv
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from src.commons.commons import exp_scale
+
+
+class Workload:
+    """
+    Synthetic workload of exponential interarrival and burst times.
+
+    Draws are vectorised: interarrival and burst arrays are sampled from a
+    numpy Generator a chunk at a time rather than one scalar per process.
+    The first chunk covers the whole run when length fits in chunk_size.
+    The stream is unbounded, further chunks are drawn if more processes
+    arrive than length before the simulation finishes.
+
+    Attributes:
+        rate: rate of process arrival per second
+        burst_lambda: average process execution time
+        chunk_size: number of processes drawn per chunk
+        rng: numpy Generator samples are drawn from
+    """
+    CHUNK_SIZE = 65536
+
+    def __init__(self,
+                 rate: float,
+                 burst_lambda: float,
+                 length: int,
+                 rng: np.random.Generator = None,
+                 chunk_size: int = CHUNK_SIZE):
+        self.rate = rate
+        self.burst_lambda = burst_lambda
+        self.chunk_size = max(1, min(length, chunk_size))
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self._arrivals = []
+        self._bursts = []
+        self._index = 0
+        self._offset = 0.0
+
+    def _sample(self) -> tuple:
+        """
+        Sample the next chunk of the stream
+        :return: (arrival times, burst times) numpy arrays of chunk_size
+        """
+        # Rates are always per second, fractional rates included
+        interarrivals = self.rng.exponential(scale=1 / self.rate, size=self.chunk_size)
+        bursts = self.rng.exponential(scale=exp_scale(self.burst_lambda), size=self.chunk_size)
+        arrivals = np.cumsum(interarrivals) + self._offset
+        self._offset = float(arrivals[-1])
+        return arrivals, bursts
+
+    def _draw_chunk(self):
+        """Sample the next chunk of arrival and burst times"""
+        arrivals, bursts = self._sample()
+        # Plain floats are much cheaper than numpy scalars in the event loop
+        self._arrivals = arrivals.tolist()
+        self._bursts = bursts.tolist()
+        self._index = 0
+
+    def chunks(self, rows: int):
+        """
+        Yield the first rows of the stream a chunk at a time.
+        Rows match what next_process would return for the same seed.
+        :param rows: total number of rows to yield
+        :return: generator of (arrival times, burst times) numpy arrays
+        """
+        remaining = rows
+        while remaining > 0:
+            arrivals, bursts = self._sample()
+            take = min(len(arrivals), remaining)
+            yield arrivals[:take], bursts[:take]
+            remaining -= take
+
+    def generate(self, out: np.ndarray):
+        """
+        Fill an (n, 2) array of (arrival, burst) rows from the start of the stream
+        :param out: array or memmap to fill
+        """
+        filled = 0
+        for arrivals, bursts in self.chunks(len(out)):
+            out[filled:filled + len(arrivals), 0] = arrivals
+            out[filled:filled + len(arrivals), 1] = bursts
+            filled += len(arrivals)
+
+    def next_process(self) -> tuple:
+        """
+        Get the next process in the stream
+        :return: (arrival time in seconds since start, burst time in seconds)
+        """
+        if self._index == len(self._arrivals):
+            self._draw_chunk()
+        i = self._index
+        self._index += 1
+        return self._arrivals[i], self._bursts[i]
+
+
+class IoModel:
+    """
+    Splits single-burst processes into alternating CPU and I/O bursts.
+
+    The number of CPU bursts is geometric with the given mean.  A process's
+    CPU time is split between its bursts at uniformly random points, so the
+    total CPU demand, and with it the offered load, matches the workload
+    without I/O.  I/O bursts are exponential.  Draws come from their own
+    Generator a chunk at a time, so the arrival and CPU time stream is the
+    same with or without I/O.
+
+    Attributes:
+        bursts: mean number of CPU bursts per process, at least 1
+        io_time: mean I/O burst time in seconds
+        rng: numpy Generator samples are drawn from
+        chunk_size: number of samples drawn per chunk
+    """
+    def __init__(self,
+                 bursts: float,
+                 io_time: float,
+                 rng: np.random.Generator,
+                 chunk_size: int = Workload.CHUNK_SIZE):
+        self.bursts = bursts
+        self.io_time = io_time
+        self.rng = rng
+        self.chunk_size = chunk_size
+        self._counts = []
+        self._count_index = 0
+        self._samples = []
+        self._sample_index = 0
+
+    def _exponentials(self, count: int) -> list:
+        """Take count unit mean exponential samples from the buffer"""
+        if self._sample_index + count > len(self._samples):
+            size = max(self.chunk_size, count)
+            self._samples = self._samples[self._sample_index:] + \
+                self.rng.exponential(size=size).tolist()
+            self._sample_index = 0
+        start = self._sample_index
+        self._sample_index += count
+        return self._samples[start:self._sample_index]
+
+    def split(self, run_time: float) -> list:
+        """
+        Split a process's CPU time into bursts
+        :param run_time: total CPU time of the process
+        :return: [cpu, io, cpu, ..., cpu] burst times, None for a single burst
+        """
+        if self._count_index == len(self._counts):
+            self._counts = self.rng.geometric(1 / self.bursts, size=self.chunk_size).tolist()
+            self._count_index = 0
+        count = self._counts[self._count_index]
+        self._count_index += 1
+        if count == 1:
+            return None
+
+        gaps = self._exponentials(count)
+        scale = run_time / sum(gaps)
+        io_times = self._exponentials(count - 1)
+        bursts = [gaps[0] * scale]
+        for gap, io_time in zip(gaps[1:], io_times):
+            bursts.append(io_time * self.io_time)
+            bursts.append(gap * scale)
+        return bursts
+
+
+class IoWorkload:
+    """
+    Wraps a workload, giving processes without their own I/O bursts some
+    drawn from an IoModel
+
+    Attributes:
+        workload: Workload|ArrayWorkload|CsvWorkload rows are read from
+        model: IoModel splitting single-burst rows
+    """
+    def __init__(self, workload, model: IoModel):
+        self.workload = workload
+        self.model = model
+
+    def next_process(self):
+        """
+        Get the next process of the wrapped workload
+        :return: (arrival, cpu time, bursts) row, bursts None for a single
+            burst, or None once the workload is exhausted
+        """
+        row = self.workload.next_process()
+        if row is None or len(row) > 2:
+            return row
+        arrival, run_time = row
+        return arrival, run_time, self.model.split(run_time)
+
+
+class ArrayWorkload:
+    """
+    Workload replayed from an (n, 2) array of (arrival, burst) rows.
+    Wider arrays hold multi-burst processes as arrival, cpu, io, cpu, ...
+    rows padded with NaN, see trace_row.
+
+    The array is usually a read-only memmap shared by every simulation of a
+    sweep, so rows are copied out a chunk at a time rather than all at once.
+    The stream ends when the array is exhausted.
+
+    Attributes:
+        trace: (n, k) array of arrival and burst times in seconds
+        chunk_size: number of rows converted per chunk
+    """
+    def __init__(self, trace: np.ndarray, chunk_size: int = Workload.CHUNK_SIZE):
+        self.trace = trace
+        self.chunk_size = chunk_size
+        self._rows = []
+        self._index = 0
+        self._start = 0
+
+    def next_process(self):
+        """
+        Get the next process in the trace
+        :return: (arrival, burst) or (arrival, cpu time, bursts) row, None once
+            the trace is exhausted
+        """
+        if self._index == len(self._rows):
+            if self._start >= len(self.trace):
+                return None
+            end = self._start + self.chunk_size
+            chunk = self.trace[self._start:end]
+            _check_sorted(self._rows[-1][0] if self._rows else 0.0, chunk[:, 0])
+            self._rows = chunk.tolist()
+            if chunk.shape[1] > 2:
+                self._rows = [trace_row(row) for row in self._rows]
+            self._start = end
+            self._index = 0
+        i = self._index
+        self._index += 1
+        return self._rows[i]
+
+
+class CsvWorkload:
+    """
+    Workload streamed from a CSV trace of arrival,burst rows.
+    Multi-burst processes continue the row with alternating io,burst
+    columns, see trace_row.
+
+    The file is read a chunk at a time so traces with millions of rows
+    never have to fit in memory.  A header row is skipped if present.
+    Arrival times are seconds since the start of the simulation and must
+    be non-decreasing.
+
+    Attributes:
+        path: path to the CSV trace
+        chunk_size: number of rows read per chunk
+    """
+    def __init__(self, path, chunk_size: int = Workload.CHUNK_SIZE):
+        self.path = str(path)
+        self.chunk_size = chunk_size
+        self._chunks = self._read()
+        self._rows = []
+        self._index = 0
+
+    def _read(self):
+        """Generator of row chunks, keeps the file open only while reading"""
+        with open(self.path, newline='') as file:
+            reader = csv.reader(file)
+            first = next(reader, None)
+            if first is None:
+                return
+            try:
+                pending = [trace_row(first)]
+            except ValueError:
+                pending = []
+            last = 0.0
+            while True:
+                rows = pending + [trace_row(row)
+                                  for row in islice(reader, self.chunk_size) if row]
+                pending = []
+                if not rows:
+                    return
+                _check_sorted(last, np.fromiter((row[0] for row in rows), dtype=np.float64))
+                last = rows[-1][0]
+                yield rows
+
+    def next_process(self):
+        """
+        Get the next process in the trace
+        :return: (arrival, burst) or (arrival, cpu time, bursts) row, None once
+            the trace is exhausted
+        """
+        if self._index == len(self._rows):
+            self._rows = next(self._chunks, [])
+            self._index = 0
+            if not self._rows:
+                return None
+        i = self._index
+        self._index += 1
+        return self._rows[i]
+
+
+def trace_row(values) -> tuple:
+    """
+    Parse one trace row of arrival followed by alternating cpu and io burst
+    times, cpu first and last.  Blank or NaN padding is ignored.
+    :param values: row of numbers or strings
+    :return: (arrival, burst) for a single CPU burst, otherwise
+        (arrival, total cpu time, [cpu, io, cpu, ..., cpu])
+    """
+    if len(values) == 2:
+        return float(values[0]), float(values[1])
+    bursts = [float(value) for value in values[1:] if value != '']
+    bursts = [burst for burst in bursts if burst == burst]
+    if len(bursts) % 2 == 0:
+        raise ValueError('Trace rows must end with a CPU burst: {}'.format(values))
+    if len(bursts) == 1:
+        return float(values[0]), bursts[0]
+    return float(values[0]), sum(bursts[0::2]), bursts
+
+
+def _check_sorted(previous: float, arrivals: np.ndarray):
+    """
+    Make sure a chunk of trace arrivals does not go back in time
+    :param previous: last arrival of the previous chunk
+    :param arrivals: arrival times of this chunk
+    """
+    if len(arrivals) and (arrivals[0] < previous or np.any(np.diff(arrivals) < 0)):
+        raise ValueError('Trace arrival times must be non-decreasing')
+
+
+def trace_length(length: int, rate: float, burst_lambda: float) -> int:
+    """
+    Number of arrivals to pre-generate for a shared trace.
+    Under overload more than length processes arrive before length complete,
+    so size the trace from the offered load rho = rate * mean burst.
+    :param length: length of simulation in processes
+    :param rate: rate of process arrival
+    :param burst_lambda: average process execution time
+    :return: number of trace rows
+    """
+    rho = exp_scale(burst_lambda) * rate
+    return int(length * max(2.0, 2.0 * rho)) + 1
+
+
+def write_shared_trace(path: Path, workload: Workload, rows: int) -> Path:
+    """
+    Generate a workload once into a .npy file workers can memory map
+    :param path: .npy file to write
+    :param workload: Workload to draw rows from
+    :param rows: number of rows to generate
+    :return: path written
+    """
+    out = np.lib.format.open_memmap(str(path), mode='w+', dtype=np.float64, shape=(rows, 2))
+    workload.generate(out)
+    out.flush()
+    del out
+    return path
+
+
+def load_shared_trace(path) -> ArrayWorkload:
+    """
+    Memory map a trace written by write_shared_trace without copying it
+    :param path: .npy file to read
+    :return: ArrayWorkload replaying the trace
+    """
+    return ArrayWorkload(np.load(str(path), mmap_mode='r'))
+
+
+def open_trace(path):
+    """
+    Open a recorded workload trace for streaming replay
+    :param path: .npy or .csv file of (arrival, burst) rows
+    :return: ArrayWorkload|CsvWorkload
+    """
+    suffix = Path(str(path)).suffix
+    if suffix == '.npy':
+        return load_shared_trace(path)
+    if suffix == '.csv':
+        return CsvWorkload(path)
+    raise ValueError('Unknown trace format: {}'.format(path))
+
+
+def trace_summary(path) -> tuple:
+    """
+    Empirical arrival rate and mean CPU time of a recorded trace, so runs
+    replaying it are labelled with the workload they actually simulate
+    :param path: .npy or .csv trace, see open_trace
+    :return: (rate, burst_lambda), burst_lambda given the way exp_scale reads it
+    """
+    workload = open_trace(path)
+    count, cpu, last = 0, 0.0, 0.0
+    row = workload.next_process()
+    while row is not None:
+        count += 1
+        cpu += row[1]
+        last = row[0]
+        row = workload.next_process()
+    if not count or last <= 0:
+        raise ValueError('Trace has no arrivals to measure a rate from: {}'.format(path))
+    mean = cpu / count
+    # exp_scale treats values above 1 as rates
+    burst_lambda = mean if mean <= 1 else 1 / mean
+    return float('{:.6g}'.format(count / last)), float('{:.6g}'.format(burst_lambda))
+
+
+def export_trace(path, workload: Workload, rows: int) -> Path:
+    """
+    Save the first rows of a synthetic workload in a format open_trace reads
+    :param path: .npy or .csv file to write
+    :param workload: Workload to draw rows from
+    :param rows: number of rows to write
+    :return: path written
+    """
+    path = Path(str(path))
+    if path.suffix == '.npy':
+        return write_shared_trace(path, workload, rows)
+    if path.suffix != '.csv':
+        raise ValueError('Unknown trace format: {}'.format(path))
+
+    with open(str(path), 'w', newline='') as file:
+        file.write('arrival,burst\n')
+        for arrivals, bursts in workload.chunks(rows):
+            np.savetxt(file, np.column_stack((arrivals, bursts)), delimiter=',', fmt='%.17g')
+    return path